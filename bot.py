@@ -4,15 +4,21 @@
 import os
 import sys
 import json
+import types
+import atexit
 import asyncio
+import functools
 import fcntl
 import logging
 import shutil
+import shlex
 import re
 import time
 import html as html_module
+from collections import OrderedDict
 from pathlib import Path
 from datetime import datetime
+from typing import NamedTuple
 
 from telegram import Update, BotCommand, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
@@ -24,6 +30,7 @@ from telegram.ext import (
     ContextTypes,
 )
 from telegram.constants import ChatAction
+from telegram.error import RetryAfter
 
 # ---------------------------------------------------------------------------
 # Configuration
@@ -31,14 +38,18 @@ from telegram.constants import ChatAction
 
 BOT_DIR = Path(__file__).resolve().parent
 
-# Load .env (simple key=value, no dependency)
+# Load .env (simple key=value, no dependency) — one C-level regex pass
+# instead of per-line strip/startswith/split calls. Whitespace inside the
+# pattern is [^\S\n] (not \s), which cannot cross line boundaries — plain
+# \s would let a blank value like "KEY=" swallow the following line.
+_ENV_RE = re.compile(
+    r"^(?![^\S\n]*#)[^\S\n]*([A-Za-z_][A-Za-z0-9_]*)[^\S\n]*=[^\S\n]*(.*?)[^\S\n]*$",
+    re.M,
+)
 _env_file = BOT_DIR / ".env"
 if _env_file.exists():
-    for line in _env_file.read_text().splitlines():
-        line = line.strip()
-        if line and not line.startswith("#") and "=" in line:
-            k, v = line.split("=", 1)
-            os.environ.setdefault(k.strip(), v.strip())
+    for m in _ENV_RE.finditer(_env_file.read_text()):
+        os.environ.setdefault(m[1], m[2])
 
 TELEGRAM_TOKEN = os.environ["TELEGRAM_TOKEN"]
 WORK_DIR = os.environ.get("CLAUDE_WORK_DIR", str(Path.home()))
@@ -52,17 +63,28 @@ STALE_TIMEOUT = int(os.environ.get("STALE_TIMEOUT", "60"))  # kill subprocess if
 MAX_MSG_LEN = 4096
 PHOTO_DIR = BOT_DIR / "photos"
 VPS_ROUTES_FILE = BOT_DIR / "vps_routes.json"
+SKILLS_CACHE_FILE = BOT_DIR / ".skills_cache.json"
+PROMPT_CACHE_FILE = BOT_DIR / ".prompt_cache.json"
 
 # Claude Code session files — derive path from WORK_DIR
 _CC_SESSIONS_DIR = (
     Path.home() / ".claude" / "projects" / WORK_DIR.replace("/", "-")
 )
 
-MODEL_ALIASES = {
+# Read-only view — nothing should mutate the alias table at runtime, and
+# an immutable mapping lets caches keyed on model state trust it.
+MODEL_ALIASES = types.MappingProxyType({
     "opus": "claude-opus-4-6",
     "sonnet": "claude-sonnet-4-6",
     "haiku": "claude-haiku-4-5-20251001",
-}
+})
+
+# Rendered once — MODEL_ALIASES is a constant, so rebuilding this string
+# on every /model call was wasted work.
+_MODEL_ALIASES_HELP = "\n".join(f"- {k}: {v}" for k, v in MODEL_ALIASES.items())
+# Lower-cased probe table so /model can match case-insensitively without
+# lowering the argument first on the common (already lower-case) path.
+_MODEL_ALIASES_CI = {k.lower(): v for k, v in MODEL_ALIASES.items()}
 
 logging.basicConfig(
     level=logging.INFO,
@@ -70,15 +92,151 @@ logging.basicConfig(
 )
 logger = logging.getLogger("claude-tg")
 
+# Optional accelerator: orjson parses/encodes JSON several times faster and
+# works on bytes directly. Not a hard dependency — stdlib json is the
+# fallback, keeping requirements at python-telegram-bot only.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_loads(data):
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def _json_dumps(obj) -> bytes:
+    if orjson:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
 # ---------------------------------------------------------------------------
 # Build a clean env for the Claude subprocess (strip nesting markers)
 # ---------------------------------------------------------------------------
 
-def _claude_env() -> dict[str, str]:
-    env = os.environ.copy()
-    for key in ("CLAUDECODE", "CLAUDE_CODE_ENTRYPOINT"):
-        env.pop(key, None)
-    return env
+# Built once at import — the parent environment doesn't change at runtime,
+# and copying it for every subprocess spawn was pure allocation churn.
+_CLAUDE_ENV = {
+    k: v for k, v in os.environ.items()
+    if k not in ("CLAUDECODE", "CLAUDE_CODE_ENTRYPOINT")
+}
+# Bound glibc heap caching in the children: without these a long-lived
+# claude process keeps large freed arenas resident, inflating its RSS for
+# the whole conversation. Respect any values already set in the service env.
+_CLAUDE_ENV.setdefault("MALLOC_TRIM_THRESHOLD_", "131072")
+_CLAUDE_ENV.setdefault("MALLOC_ARENA_MAX", "2")
+
+# ---------------------------------------------------------------------------
+# Debounced persistence — coalesce bursts of state mutations into one write
+# ---------------------------------------------------------------------------
+
+_FLUSH_DELAY = 0.5  # seconds to wait for further mutations before writing
+
+_dirty: set[str] = set()
+_flush_task: asyncio.Task | None = None
+
+
+def _load_json(path: Path, default):
+    """Load a JSON state file, returning *default* if absent or corrupt.
+
+    A truncated or garbled file (e.g. after a crash on an old version
+    without atomic writes) degrades to the default instead of taking the
+    whole bot down at import time.
+    """
+    if not path.exists():
+        return default
+    try:
+        return _json_loads(path.read_bytes())
+    except (ValueError, OSError) as e:
+        logger.warning("Failed to load %s: %s", path, e)
+        return default
+
+
+def _atomic_write_bytes(path: Path, data: bytes, fsync: bool = False) -> None:
+    """Write *data* via a temp sibling + os.replace so readers never see a
+    partially written file.
+
+    fsync is reserved for the shutdown flush — paying it on every
+    debounced write would defeat the point of coalescing.
+    """
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        if fsync:
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _serialize_state(name: str) -> tuple[Path, object]:
+    if name == "settings":
+        return SETTINGS_FILE, _settings
+    if name == "recents":
+        return RECENTS_FILE, {str(k): v for k, v in _recents.items()}
+    return SESSION_FILE, {str(k): v.to_dict() for k, v in _sessions.items()}
+
+
+_last_written: dict[Path, bytes] = {}  # last payload per file, to skip no-op writes
+
+
+def _write_payloads(payloads: list[tuple[Path, bytes]], durable: bool = False) -> None:
+    for path, data in payloads:
+        if _last_written.get(path) == data:
+            continue  # identical to what is already on disk
+        try:
+            _atomic_write_bytes(path, data, fsync=durable)
+            _last_written[path] = data
+        except OSError as e:
+            logger.warning("Failed to write %s: %s", path, e)
+
+
+def _drain_dirty() -> list[tuple[Path, bytes]]:
+    """Snapshot-encode every dirty state file (cheap, and done on the loop
+    so the writer thread never sees state mid-mutation)."""
+    payloads: list[tuple[Path, bytes]] = []
+    while _dirty:
+        path, obj = _serialize_state(_dirty.pop())
+        payloads.append((path, _json_dumps(obj)))
+    return payloads
+
+
+def _flush_state(durable: bool = False) -> None:
+    """Write every dirty state file to disk (compact JSON, atomic replace)."""
+    _write_payloads(_drain_dirty(), durable=durable)
+
+
+async def _flush_after_delay() -> None:
+    global _flush_task
+    try:
+        await asyncio.sleep(_FLUSH_DELAY)
+        payloads = _drain_dirty()
+        if payloads:
+            # Disk I/O runs on a worker thread — small files, but fsync
+            # contention can stall the loop for milliseconds.
+            await asyncio.to_thread(_write_payloads, payloads)
+    finally:
+        _flush_task = None
+
+
+def _mark_dirty(name: str) -> None:
+    """Record a pending state write and schedule a coalescing flush.
+
+    Mutations arriving within the debounce window are folded into one
+    write. Falls back to an immediate write when no event loop is running
+    (import-time and shutdown paths).
+    """
+    global _flush_task
+    _dirty.add(name)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _flush_state()
+        return
+    if _flush_task is None or _flush_task.done():
+        _flush_task = loop.create_task(_flush_after_delay())
+
+
+atexit.register(_flush_state, True)  # durable flush of pending writes on shutdown
+
 
 # ---------------------------------------------------------------------------
 # Instance lock — prevent dual-instance Telegram Conflict errors
@@ -91,14 +249,20 @@ def _acquire_lock() -> None:
     """Acquire an exclusive file lock so only one bot instance can run."""
     global _lock_fd
     lock_path = BOT_DIR / "bot.lock"
-    _lock_fd = open(lock_path, "w")
+    # Raw fd with O_CLOEXEC from the start: no buffered-I/O layer, and the
+    # lock fd can never leak into claude children via close_fds=False
+    # spawns, which could hold the instance lock past our own death.
+    _lock_fd = os.open(lock_path, os.O_WRONLY | os.O_CREAT | os.O_CLOEXEC, 0o644)
     try:
         fcntl.flock(_lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
     except BlockingIOError:
         logger.error("Another instance is already running (lock: %s)", lock_path)
         sys.exit(1)
-    _lock_fd.write(str(os.getpid()))
-    _lock_fd.flush()
+    # Truncate only after the lock is ours — a losing second instance must
+    # not clobber the winner's pid.
+    os.ftruncate(_lock_fd, 0)
+    os.write(_lock_fd, str(os.getpid()).encode())
+    os.fsync(_lock_fd)
     logger.info("Acquired instance lock (pid=%d)", os.getpid())
 
 
@@ -108,6 +272,14 @@ def _acquire_lock() -> None:
 
 PLUGINS_DIR = Path.home() / ".claude" / "plugins"
 
+# Directories that never contain skills — pruned during the plugin walk so
+# os.walk never descends into them (node_modules alone can be thousands of
+# entries in an installed plugin).
+_PRUNE = frozenset({
+    "node_modules", ".git", "__pycache__", ".venv", "venv",
+    "dist", "build", ".mypy_cache", ".pytest_cache", ".cache",
+})
+
 
 def discover_skills() -> list[dict]:
     """Scan installed plugins for user-invocable skills.
@@ -119,64 +291,82 @@ def discover_skills() -> list[dict]:
         logger.warning("No installed_plugins.json found")
         return []
 
-    installed = json.loads(manifest.read_text())
+    # Warm-start cache: the walk only needs to happen again when the plugin
+    # manifest changes, so key the cached result on its mtime+size and skip
+    # the whole traversal on a hit (one stat + one json.loads).
+    m = manifest.stat()
+    cache_key = [m.st_mtime_ns, m.st_size]
+    if SKILLS_CACHE_FILE.exists():
+        try:
+            cached = _json_loads(SKILLS_CACHE_FILE.read_bytes())
+            if cached.get("key") == cache_key:
+                logger.info("Loaded %d skills from cache", len(cached["skills"]))
+                return cached["skills"]
+        except (ValueError, KeyError, OSError):
+            pass
+
+    installed = _json_loads(manifest.read_bytes())
     skills: list[dict] = []
     seen: set[str] = set()
 
-    for plugin_key, versions in installed.get("plugins", {}).items():
+    # Sorted plugin order keeps the `seen` dedupe's first-wins result
+    # deterministic without sorting inside the walk.
+    for plugin_key, versions in sorted(installed.get("plugins", {}).items()):
         if not versions:
             continue
-        install_path = Path(versions[-1]["installPath"])
+        install_path = str(Path(versions[-1]["installPath"]))
         plugin_name = plugin_key.split("@")[0]
 
-        # Pattern 1: skills/*/SKILL.md (superpowers, claude-md-management)
-        for skill_md in sorted(install_path.rglob("skills/*/SKILL.md")):
-            skill_name = skill_md.parent.name
-            # Skip if nested deeper (e.g. skills/notion/subskill/SKILL.md handled below)
-            if skill_md.parent.parent.name != "skills":
-                continue
-            if skill_name in seen:
-                continue
-            seen.add(skill_name)
-            skills.append({
-                "name": skill_name,
-                "plugin": plugin_name,
-                "slash": f"/{skill_name}",
-            })
-
-        # Pattern 2: commands/*.md and commands/*/*.md (code-review, Notion, pr-review-toolkit)
-        commands_dir = install_path / "commands"
-        if commands_dir.is_dir():
-            for cmd_md in sorted(commands_dir.rglob("*.md")):
-                # Derive skill name from path: commands/foo.md -> foo, commands/tasks/build.md -> tasks:build
-                rel = cmd_md.relative_to(commands_dir)
-                parts = list(rel.with_suffix("").parts)
-                skill_name = ":".join(parts)  # e.g. "find", "tasks:build"
-                if skill_name in seen:
-                    continue
-                seen.add(skill_name)
-                skills.append({
-                    "name": skill_name,
-                    "plugin": plugin_name,
-                    "slash": f"/{skill_name}",
-                })
-
-        # Pattern 3: skills/*/*/SKILL.md (Notion deep skills like skills/notion/knowledge-capture/)
-        for skill_md in sorted(install_path.rglob("skills/*/*/SKILL.md")):
-            skill_name = skill_md.parent.name
-            if skill_name in seen:
-                continue
-            seen.add(skill_name)
-            skills.append({
-                "name": skill_name,
-                "plugin": plugin_name,
-                "slash": f"/{skill_name}",
-            })
+        # One walk per plugin covers all three layout patterns:
+        #   1. skills/*/SKILL.md        (superpowers, claude-md-management)
+        #   2. commands/**/*.md         (code-review, Notion, pr-review-toolkit)
+        #   3. skills/*/*/SKILL.md      (Notion deep skills)
+        # Classifying by depth in a single os.walk avoids the three full
+        # rglob traversals (and their repeated stat calls) per plugin.
+        for dirpath, dirnames, filenames in os.walk(install_path):
+            # Prune before os.walk recurses — assigning to the slice is what
+            # stops the descent.
+            dirnames[:] = [d for d in dirnames if d not in _PRUNE]
+            dirnames.sort()  # deterministic first-wins order for `seen`
+            rel = os.path.relpath(dirpath, install_path)
+            parts = () if rel == "." else tuple(rel.split(os.sep))
+
+            if parts[:1] == ("skills",):
+                # Nothing below skills/*/* can match either pattern.
+                if len(parts) >= 3:
+                    dirnames[:] = []
+                # SKILL.md at depth 2 (pattern 1) or depth 3 (pattern 3);
+                # the skill is named after its containing directory.
+                if len(parts) in (2, 3) and "SKILL.md" in filenames:
+                    skill_name = parts[-1]
+                    if skill_name not in seen:
+                        seen.add(skill_name)
+                        skills.append({
+                            "name": skill_name,
+                            "plugin": plugin_name,
+                            "slash": f"/{skill_name}",
+                        })
+            elif parts[:1] == ("commands",):
+                # commands/foo.md -> foo, commands/tasks/build.md -> tasks:build
+                for fname in sorted(filenames):
+                    if not fname.endswith(".md"):
+                        continue
+                    skill_name = ":".join(parts[1:] + (fname[:-3],))
+                    if skill_name in seen:
+                        continue
+                    seen.add(skill_name)
+                    skills.append({
+                        "name": skill_name,
+                        "plugin": plugin_name,
+                        "slash": f"/{skill_name}",
+                    })
 
     # Pattern 4: ~/.claude/commands/*.md (user-level Claude Code slash commands)
     user_commands_dir = Path.home() / ".claude" / "commands"
     if user_commands_dir.is_dir():
-        for cmd_md in sorted(user_commands_dir.glob("*.md")):
+        # No sort needed: stems are unique within the directory, and the
+        # final sort below orders the combined list.
+        for cmd_md in user_commands_dir.glob("*.md"):
             skill_name = cmd_md.stem
             if skill_name in seen:
                 continue
@@ -190,7 +380,7 @@ def discover_skills() -> list[dict]:
     # Pattern 5: ~/.claude/skills/*/SKILL.md (user-level custom skills)
     user_skills_dir = Path.home() / ".claude" / "skills"
     if user_skills_dir.is_dir():
-        for skill_md in sorted(user_skills_dir.glob("*/SKILL.md")):
+        for skill_md in user_skills_dir.glob("*/SKILL.md"):
             skill_name = skill_md.parent.name
             if skill_name in seen:
                 continue
@@ -203,10 +393,29 @@ def discover_skills() -> list[dict]:
 
     skills.sort(key=lambda s: s["name"])
     logger.info("Discovered %d skills from %d plugins + user commands", len(skills), len(installed.get("plugins", {})))
+
+    try:
+        _atomic_write_bytes(SKILLS_CACHE_FILE, _json_dumps({"key": cache_key, "skills": skills}))
+    except OSError as e:
+        logger.warning("Failed to write skills cache: %s", e)
+
     return skills
 
 
-_skills: list[dict] = discover_skills()
+_skills: list[dict] | None = None
+
+
+def _get_skills() -> list[dict]:
+    """Run discovery on first use instead of at import.
+
+    Startup no longer blocks on the plugin-tree walk; _post_init warms
+    this in a background thread so the first Skills tap is still instant.
+    The result is immutable afterwards.
+    """
+    global _skills
+    if _skills is None:
+        _skills = discover_skills()
+    return _skills
 
 # ---------------------------------------------------------------------------
 # Skill group mapping — plugin name → (emoji, display label)
@@ -280,14 +489,25 @@ def _group_emoji(plugin: str) -> str:
     return "🔌"
 
 
+@functools.lru_cache(maxsize=None)
 def _skills_by_group() -> dict[str, list[dict]]:
-    """Group discovered skills by plugin name."""
+    """Group discovered skills by plugin name.
+
+    Cached — the skill list is immutable after discovery, and this was
+    rebuilt on every Skills-menu tap.
+    """
     groups: dict[str, list[dict]] = {}
-    for sk in _skills:
+    for sk in _get_skills():
         groups.setdefault(sk["plugin"], []).append(sk)
     return groups
 
 
+@functools.lru_cache(maxsize=None)
+def _skills_by_name() -> dict[str, dict]:
+    """Name → skill index for O(1) ``sk:<name>`` callback dispatch."""
+    return {sk["name"]: sk for sk in _get_skills()}
+
+
 # ---------------------------------------------------------------------------
 # Owner persistence (first /start wins)
 # ---------------------------------------------------------------------------
@@ -297,15 +517,14 @@ _owner_id: int | None = None
 
 def _load_owner() -> int | None:
     global _owner_id
-    if OWNER_FILE.exists():
-        _owner_id = json.loads(OWNER_FILE.read_text()).get("owner_id")
+    _owner_id = _load_json(OWNER_FILE, {}).get("owner_id")
     return _owner_id
 
 
 def _save_owner(uid: int) -> None:
     global _owner_id
     _owner_id = uid
-    OWNER_FILE.write_text(json.dumps({"owner_id": uid}))
+    _atomic_write_bytes(OWNER_FILE, _json_dumps({"owner_id": uid}))
     logger.info("Owner set to %s", uid)
 
 
@@ -320,13 +539,12 @@ _settings: dict[str, str] = {}
 
 def _load_settings() -> None:
     global _settings
-    if SETTINGS_FILE.exists():
-        _settings = json.loads(SETTINGS_FILE.read_text())
+    _settings = _load_json(SETTINGS_FILE, {})
     logger.info("Loaded settings: %s", _settings)
 
 
 def _save_settings() -> None:
-    SETTINGS_FILE.write_text(json.dumps(_settings, indent=2))
+    _mark_dirty("settings")
 
 
 _load_settings()
@@ -340,14 +558,12 @@ _recents: dict[int, list[str]] = {}
 
 def _load_recents() -> None:
     global _recents
-    if RECENTS_FILE.exists():
-        raw = json.loads(RECENTS_FILE.read_text())
-        _recents = {int(k): v for k, v in raw.items()}
+    _recents = {int(k): v for k, v in _load_json(RECENTS_FILE, {}).items()}
     logger.info("Loaded recents for %d user(s)", len(_recents))
 
 
 def _save_recents() -> None:
-    RECENTS_FILE.write_text(json.dumps({str(k): v for k, v in _recents.items()}, indent=2))
+    _mark_dirty("recents")
 
 
 def _record_recent(chat_id: int, name: str) -> None:
@@ -370,13 +586,12 @@ _vps_routes: dict[str, dict] = {}
 
 def _load_vps_routes() -> None:
     global _vps_routes
-    if VPS_ROUTES_FILE.exists():
-        _vps_routes = json.loads(VPS_ROUTES_FILE.read_text())
+    _vps_routes = _load_json(VPS_ROUTES_FILE, {})
     logger.info("Loaded %d VPS route(s)", len(_vps_routes))
 
 
 def _save_vps_routes() -> None:
-    VPS_ROUTES_FILE.write_text(json.dumps(_vps_routes, indent=2))
+    _atomic_write_bytes(VPS_ROUTES_FILE, _json_dumps(_vps_routes))
 
 
 _load_vps_routes()
@@ -386,7 +601,43 @@ _load_vps_routes()
 # ---------------------------------------------------------------------------
 
 
+# created_at only has minute resolution, so format at most once per minute
+# instead of running strftime on every session create/resume.
+_ts_cache = {"minute": -1, "str": ""}
+
+
+def _now_minute_str() -> str:
+    minute = int(time.time()) // 60
+    if minute != _ts_cache["minute"]:
+        _ts_cache["minute"] = minute
+        _ts_cache["str"] = time.strftime("%Y-%m-%d %H:%M", time.localtime(minute * 60))
+    return _ts_cache["str"]
+
+
+class PendingAction(NamedTuple):
+    """What the next plain-text message should be turned into.
+
+    kind is "skill" (prefix with /<name>) or "git" (fill in a git prompt
+    template) — no more packing both into one string and re-parsing it.
+    """
+
+    kind: str
+    name: str
+
+
 class Session:
+    # No per-instance __dict__: the fixed attribute set is touched on
+    # every message and callback, and slots keep lookups cheap.
+    __slots__ = (
+        "session_id",
+        "created_at",
+        "message_count",
+        "busy",
+        "pending_action",
+        "queue",
+        "active_task",
+    )
+
     def __init__(
         self,
         session_id: str | None = None,
@@ -397,8 +648,20 @@ class Session:
         self.created_at = created_at
         self.message_count = message_count
         self.busy = False
-        self.pending_skill: str | None = None  # ephemeral, not persisted
+        self.pending_action: PendingAction | None = None  # ephemeral, not persisted
         self.queue: list[str] = []  # ephemeral — messages queued while busy
+        self.active_task: asyncio.Task | None = None  # ephemeral — in-flight turn
+
+    def reset(self) -> None:
+        """Start fresh in place — reuses the object so hot ``/new`` flows
+        don't reallocate and rehash the sessions dict."""
+        self.session_id = None
+        self.created_at = None
+        self.message_count = 0
+        self.busy = False
+        self.pending_action = None
+        self.queue.clear()
+        self.active_task = None
 
     def to_dict(self) -> dict:
         return {
@@ -416,21 +679,20 @@ class Session:
         )
 
 
-_sessions: dict[int, Session] = {}
+# LRU-ordered: bounded so a long-lived process never accumulates (and
+# re-serializes) records for chats that went quiet long ago.
+_MAX_SESSIONS = 64
+_sessions: OrderedDict[int, Session] = OrderedDict()
 
 
 def _load_sessions() -> None:
-    if SESSION_FILE.exists():
-        raw = json.loads(SESSION_FILE.read_text())
-        for cid, data in raw.items():
-            _sessions[int(cid)] = Session.from_dict(data)
+    for cid, data in _load_json(SESSION_FILE, {}).items():
+        _sessions[int(cid)] = Session.from_dict(data)
     logger.info("Loaded %d session(s)", len(_sessions))
 
 
 def _save_sessions() -> None:
-    SESSION_FILE.write_text(
-        json.dumps({str(k): v.to_dict() for k, v in _sessions.items()}, indent=2)
-    )
+    _mark_dirty("sessions")
 
 
 _load_sessions()
@@ -439,6 +701,10 @@ _load_sessions()
 def _get_session(chat_id: int) -> Session:
     if chat_id not in _sessions:
         _sessions[chat_id] = Session()
+        while len(_sessions) > _MAX_SESSIONS:
+            _sessions.popitem(last=False)
+    else:
+        _sessions.move_to_end(chat_id)
     return _sessions[chat_id]
 
 
@@ -447,69 +713,133 @@ def _get_session(chat_id: int) -> Session:
 # ---------------------------------------------------------------------------
 
 
+_TITLE_HEAD_BYTES = 16384  # slugs (renamed titles) live near the top
+_TITLE_TAIL_BYTES = 65536  # the newest user message lives near the bottom
+
+
+def _extract_session_title(path: str, size: int) -> str:
+    """Pull the slug or latest user message from a session JSONL.
+
+    Only the head and tail chunks are read in binary mode — for multi-MB
+    histories this replaces a full decode-and-parse of every line with at
+    most ~80 KB of I/O. Partial lines at chunk boundaries are skipped.
+    """
+    latest_user_msg = ""
+
+    def _scan(lines: list[bytes]) -> str:
+        nonlocal latest_user_msg
+        for line in lines:
+            if not line:
+                continue
+            try:
+                entry = _json_loads(line)
+            except ValueError:
+                continue  # partial line at a chunk boundary
+
+            # Prefer slug (renamed session title) if present
+            if "slug" in entry:
+                slug = (entry.get("slug") or "").strip()
+                if slug:
+                    return slug
+
+            # Capture latest user message as fallback (keep updating)
+            if entry.get("type") == "user":
+                msg = entry.get("message", {})
+                content = msg.get("content", "")
+                if isinstance(content, list):
+                    # Content can be a list of blocks
+                    content = " ".join(
+                        b.get("text", "") for b in content
+                        if isinstance(b, dict)
+                    )
+                latest_user_msg = content.strip()
+        return ""
+
+    try:
+        with open(path, "rb") as fh:
+            slug = _scan(fh.read(_TITLE_HEAD_BYTES).splitlines())
+            if slug:
+                return slug
+            if size > _TITLE_HEAD_BYTES:
+                tail_start = max(_TITLE_HEAD_BYTES, size - _TITLE_TAIL_BYTES)
+                fh.seek(tail_start)
+                lines = fh.read().split(b"\n")[1:]  # drop partial first line
+                slug = _scan(lines)
+                if slug:
+                    return slug
+    except OSError:
+        pass
+    return latest_user_msg
+
+
+# session_id -> [mtime, size, title] — survives restarts so repeat History
+# opens skip the file reads entirely.
+_prompt_cache: dict[str, list] = _load_json(PROMPT_CACHE_FILE, {})
+
+
+# Page cache for the scan below. Session files are appended to in place,
+# which leaves every directory mtime untouched, so mtime alone cannot
+# invalidate — a short TTL bounds staleness instead: pagination taps
+# within a browse hit memory, edits show up within seconds.
+_CC_SCAN_TTL = 5.0
+_cc_scan_cache: dict[tuple[int, int], tuple[float, list[dict], int]] = {}
+
+
 def _scan_cc_sessions(limit: int = 8, offset: int = 0) -> tuple[list[dict], int]:
     """Scan Claude Code session files and return recent sessions with metadata.
 
     Displays renamed session titles (slug) if available, otherwise falls back to
     the latest user message. Returns (sessions, total_count).
     """
-    if not _CC_SESSIONS_DIR.is_dir():
+    now = time.monotonic()
+    hit = _cc_scan_cache.get((limit, offset))
+    if hit and now - hit[0] < _CC_SCAN_TTL:
+        return hit[1], hit[2]
+
+    # One scandir pass per directory, keeping each entry's stat result so
+    # the sort key and the metadata below never stat the same file twice.
+    entries: list[tuple[str, str, os.stat_result]] = []  # (path, stem, stat)
+    try:
+        with os.scandir(_CC_SESSIONS_DIR) as outer:
+            subdirs = [d.path for d in outer if d.is_dir(follow_symlinks=False)]
+        for sub in subdirs:
+            with os.scandir(sub) as inner:
+                for e in inner:
+                    if e.name.endswith(".jsonl") and e.is_file(follow_symlinks=False):
+                        entries.append((e.path, e.name[:-6], e.stat()))
+    except OSError:
         return [], 0
 
-    all_files = sorted(
-        _CC_SESSIONS_DIR.glob("*/*.jsonl"),
-        key=lambda f: f.stat().st_mtime,
-        reverse=True,
-    )
-    total = len(all_files)
-    session_files = all_files[offset:offset + limit]
+    entries.sort(key=lambda t: t[2].st_mtime, reverse=True)
+    total = len(entries)
 
     results: list[dict] = []
-    for f in session_files:
-        sid = f.stem
-        st = f.stat()
-        mtime = datetime.fromtimestamp(st.st_mtime)
-
-        # Read renamed slug (if exists) or latest user message as fallback
-        prompt = ""
-        latest_user_msg = ""
-        try:
-            with open(f) as fh:
-                for line in fh:
-                    entry = json.loads(line)
-
-                    # Prefer slug (renamed session title) if present
-                    if "slug" in entry:
-                        slug = entry.get("slug", "").strip()
-                        if slug:
-                            prompt = slug
-                            break
-
-                    # Capture latest user message as fallback (keep updating to get the newest)
-                    if entry.get("type") == "user":
-                        msg = entry.get("message", {})
-                        content = msg.get("content", "")
-                        if isinstance(content, list):
-                            # Content can be a list of blocks
-                            content = " ".join(
-                                b.get("text", "") for b in content
-                                if isinstance(b, dict)
-                            )
-                        latest_user_msg = content.strip()
-        except (json.JSONDecodeError, IOError):
-            pass
-
-        # Use slug if found, otherwise use latest user message
-        if not prompt:
-            prompt = latest_user_msg
-
+    cache_dirty = False
+    for f, sid, st in entries[offset:offset + limit]:
+        cached = _prompt_cache.get(sid)
+        if cached and cached[0] == st.st_mtime and cached[1] == st.st_size:
+            prompt = cached[2]
+        else:
+            prompt = _extract_session_title(f, st.st_size)
+            _prompt_cache[sid] = [st.st_mtime, st.st_size, prompt]
+            cache_dirty = True
         results.append({
             "session_id": sid,
             "prompt": prompt[:60] or sid[:12],
-            "mtime": mtime,
+            "mtime": datetime.fromtimestamp(st.st_mtime),
             "size_kb": st.st_size / 1024,
         })
 
+    if cache_dirty:
+        try:
+            _atomic_write_bytes(PROMPT_CACHE_FILE, _json_dumps(_prompt_cache))
+        except OSError as e:
+            logger.warning("Failed to write %s: %s", PROMPT_CACHE_FILE, e)
+
+    for key, entry in list(_cc_scan_cache.items()):
+        if now - entry[0] >= _CC_SCAN_TTL:
+            del _cc_scan_cache[key]
+    _cc_scan_cache[(limit, offset)] = (now, results, total)
     return results, total
 
 
@@ -521,10 +851,17 @@ def _scan_cc_sessions(limit: int = 8, offset: int = 0) -> tuple[list[dict], int]
 def _proc_cpu_ticks(pid: int) -> int | None:
     """Read total CPU ticks (utime+stime) from /proc/<pid>/stat."""
     try:
-        with open(f"/proc/{pid}/stat") as f:
-            parts = f.read().split()
-            return int(parts[13]) + int(parts[14])
-    except (FileNotFoundError, ProcessLookupError, IndexError, ValueError):
+        fd = os.open(f"/proc/{pid}/stat", os.O_RDONLY)
+        try:
+            data = os.read(fd, 1024)
+        finally:
+            os.close(fd)
+        # comm (field 2) may itself contain spaces or parens; the fixed
+        # fields start after the last ")". utime/stime are fields 14/15,
+        # i.e. indexes 11/12 of the remainder.
+        fields = data[data.rfind(b")") + 2:].split()
+        return int(fields[11]) + int(fields[12])
+    except (OSError, IndexError, ValueError):
         return None
 
 
@@ -582,14 +919,22 @@ async def run_claude(
     if _settings.get("skip_permissions") == "1":
         cmd.append("--dangerously-skip-permissions")
 
-    logger.info("Running: %s (cwd=%s)", " ".join(cmd), _dir)
+    if logger.isEnabledFor(logging.INFO):
+        # cmd embeds the full prompt (can be tens of KB) — cap it and
+        # quote for shell-copyable logs, and only when INFO is live.
+        shown = [a if len(a) <= 200 else a[:200] + "…" for a in cmd]
+        logger.info("Running: %s (cwd=%s)", shlex.join(shown), _dir)
 
+    # close_fds=False keeps subprocess on the posix_spawn fast path
+    # (constant-time regardless of parent heap size); every fd we hold is
+    # marked CLOEXEC so nothing sensitive leaks into the child.
     proc = await asyncio.create_subprocess_exec(
         *cmd,
         stdout=asyncio.subprocess.PIPE,
         stderr=asyncio.subprocess.PIPE,
         cwd=_dir,
-        env=_claude_env(),
+        env=_CLAUDE_ENV,
+        close_fds=False,
     )
 
     watchdog = asyncio.create_task(_cpu_watchdog(proc, STALE_TIMEOUT))
@@ -604,107 +949,204 @@ async def run_claude(
             "result": f"Timed out after {timeout}s",
             "session_id": session_id,
         }
+    except asyncio.CancelledError:
+        proc.kill()  # superseded turn — don't leave the CLI running
+        raise
     finally:
         watchdog.cancel()
 
-    raw = stdout.decode()
-
     if proc.returncode != 0:
-        err = stderr.decode().strip() or raw.strip() or f"Exit code {proc.returncode}"
+        err = (
+            stderr.decode().strip()
+            or stdout.decode().strip()
+            or f"Exit code {proc.returncode}"
+        )
         return {"is_error": True, "result": err, "session_id": session_id}
 
     try:
-        return json.loads(raw)
-    except json.JSONDecodeError:
-        return {"result": raw.strip(), "session_id": session_id}
-
-
-async def run_claude_streaming(
-    prompt: str,
-    session_id: str | None = None,
-    timeout: int = COMMAND_TIMEOUT,
-    work_dir: str | None = None,
-    claude_bin: str | None = None,
-    on_text=None,
-) -> dict:
-    """Run claude -p with stream-json and call on_text(text) as content arrives.
-
-    Uses create_subprocess_exec (arg-list form, no shell) for safety.
-    Falls back to non-streaming run_claude if the stream fails to produce events.
+        # Parse the raw bytes — skips a full UTF-8 decode pass on the
+        # success path (and lets orjson parse without a str copy).
+        return _json_loads(stdout)
+    except ValueError:
+        return {"result": stdout.decode().strip(), "session_id": session_id}
+
+
+class ClaudeWorker:
+    """Long-lived ``claude -p`` subprocess speaking stream-json on stdin/stdout.
+
+    One worker per chat. Keeping the CLI process alive between turns
+    amortizes its startup (interpreter boot, settings parse, auth) across
+    the whole conversation instead of paying it on every message. The CLI
+    cannot switch sessions or flags in-band, so the worker respawns
+    whenever the resume target, model, sudo flag, or work dir changes;
+    within an ongoing conversation the same process just keeps going.
     """
-    _bin = claude_bin or CLAUDE_BIN
-    _dir = work_dir or WORK_DIR
 
-    cmd = [_bin, "-p", prompt, "--output-format", "stream-json", "--verbose"]
-    if session_id:
-        cmd += ["--resume", session_id]
-    if model := _settings.get("model"):
-        cmd += ["--model", model]
-    if _settings.get("skip_permissions") == "1":
-        cmd.append("--dangerously-skip-permissions")
+    def __init__(self) -> None:
+        self.proc: asyncio.subprocess.Process | None = None
+        self.lock = asyncio.Lock()  # serialize turns on one process
+        self._cfg: tuple | None = None  # (model, sudo, work_dir, bin) of live proc
+        self._sid: str | None = None  # session id the live proc is on
 
-    logger.info("Running (stream): %s (cwd=%s)", " ".join(cmd[:8]), _dir)
+    def _alive(self) -> bool:
+        return self.proc is not None and self.proc.returncode is None
 
-    proc = await asyncio.create_subprocess_exec(
-        *cmd,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-        cwd=_dir,
-        env=_claude_env(),
-    )
+    def close(self) -> None:
+        if self._alive():
+            try:
+                self.proc.kill()
+            except ProcessLookupError:
+                pass
+        self.proc = None
+        self._cfg = None
+        self._sid = None
+
+    async def _ensure(self, session_id: str | None, work_dir: str, claude_bin: str) -> None:
+        """(Re)spawn the subprocess if dead or launched with a stale config."""
+        cfg = (
+            _settings.get("model"),
+            _settings.get("skip_permissions") == "1",
+            work_dir,
+            claude_bin,
+        )
+        if self._alive() and cfg == self._cfg and session_id == self._sid:
+            return
+        self.close()
 
-    watchdog = asyncio.create_task(_cpu_watchdog(proc, STALE_TIMEOUT))
-    result_data: dict = {}
-    accumulated_text = ""
+        cmd = [
+            claude_bin, "-p",
+            "--input-format", "stream-json",
+            "--output-format", "stream-json",
+            "--verbose",
+        ]
+        if session_id:
+            cmd += ["--resume", session_id]
+        if cfg[0]:
+            cmd += ["--model", cfg[0]]
+        if cfg[1]:
+            cmd.append("--dangerously-skip-permissions")
+
+        logger.info("Spawning claude worker (resume=%s, cwd=%s)", session_id, work_dir)
+        self.proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            cwd=work_dir,
+            env=_CLAUDE_ENV,
+            close_fds=False,  # posix_spawn fast path; held fds are CLOEXEC
+        )
+        self._cfg = cfg
+        self._sid = session_id
 
-    try:
-        async def _read_stream():
-            nonlocal accumulated_text, result_data
-            async for raw_line in proc.stdout:
-                line = raw_line.decode().strip()
-                if not line:
-                    continue
+    async def send(
+        self,
+        prompt: str,
+        session_id: str | None = None,
+        timeout: int = COMMAND_TIMEOUT,
+        work_dir: str | None = None,
+        claude_bin: str | None = None,
+        on_text=None,
+    ) -> dict:
+        """Run one turn and return a run_claude-style result dict.
+
+        Calls on_text(text) as assistant content arrives, like the old
+        streaming runner did.
+        """
+        async with self.lock:
+            await self._ensure(
+                session_id, work_dir or WORK_DIR, claude_bin or CLAUDE_BIN
+            )
+            msg = {
+                "type": "user",
+                "message": {
+                    "role": "user",
+                    "content": [{"type": "text", "text": prompt}],
+                },
+            }
+            # The watchdog only runs while a turn is in flight — an idle
+            # worker legitimately sits at zero CPU between messages.
+            watchdog = asyncio.create_task(_cpu_watchdog(self.proc, STALE_TIMEOUT))
+            try:
+                self.proc.stdin.write(_json_dumps(msg) + b"\n")
+                await self.proc.stdin.drain()
+                result = await asyncio.wait_for(self._read_turn(on_text), timeout=timeout)
+            except asyncio.TimeoutError:
+                self.close()
+                return {
+                    "is_error": True,
+                    "timed_out": True,
+                    "result": f"Timed out after {timeout}s",
+                    "session_id": session_id,
+                }
+            except asyncio.CancelledError:
+                self.close()  # mid-turn state is unrecoverable — respawn next turn
+                raise
+            except (BrokenPipeError, ConnectionResetError):
+                self.close()
+                return {
+                    "is_error": True,
+                    "result": "Claude worker pipe broke",
+                    "session_id": session_id,
+                }
+            finally:
+                watchdog.cancel()
+
+            if result.get("session_id"):
+                # Track the id the live process is now on so the next turn
+                # of this conversation reuses it instead of respawning.
+                self._sid = result["session_id"]
+            return result
+
+    async def _read_turn(self, on_text) -> dict:
+        accumulated_text = ""
+        while True:
+            raw_line = await self.proc.stdout.readline()
+            if not raw_line:
+                # EOF mid-turn — the worker died; surface stderr if any.
+                err = b""
                 try:
-                    event = json.loads(line)
-                except json.JSONDecodeError:
-                    continue
-
-                etype = event.get("type")
-                if etype == "assistant":
-                    msg = event.get("message", {})
-                    for block in msg.get("content", []):
-                        if block.get("type") == "text":
-                            accumulated_text = block.get("text", "")
-                            if on_text and accumulated_text:
-                                await on_text(accumulated_text)
-                elif etype == "result":
-                    result_data = {
-                        "result": event.get("result", accumulated_text),
-                        "session_id": event.get("session_id"),
-                        "is_error": event.get("is_error", False),
-                        "cost_usd": event.get("total_cost_usd"),
-                        "num_turns": event.get("num_turns"),
-                        "duration_ms": event.get("duration_ms"),
-                    }
-
-        await asyncio.wait_for(_read_stream(), timeout=timeout)
-        await proc.wait()
+                    err = await self.proc.stderr.read()
+                except (OSError, ValueError):
+                    pass
+                self.close()
+                return {
+                    "is_error": True,
+                    "result": err.decode().strip() or "Claude worker exited unexpectedly",
+                }
+            line = raw_line.strip()
+            if not line:
+                continue
+            try:
+                event = _json_loads(line)
+            except ValueError:
+                continue
 
-    except asyncio.TimeoutError:
-        proc.kill()
-        return {
-            "is_error": True,
-            "timed_out": True,
-            "result": f"Timed out after {timeout}s",
-            "session_id": session_id,
-        }
-    finally:
-        watchdog.cancel()
+            etype = event.get("type")
+            if etype == "assistant":
+                for block in event.get("message", {}).get("content", []):
+                    if block.get("type") == "text":
+                        accumulated_text = block.get("text", "")
+                        if on_text and accumulated_text:
+                            await on_text(accumulated_text)
+            elif etype == "result":
+                return {
+                    "result": event.get("result", accumulated_text),
+                    "session_id": event.get("session_id"),
+                    "is_error": event.get("is_error", False),
+                    "cost_usd": event.get("total_cost_usd"),
+                    "num_turns": event.get("num_turns"),
+                    "duration_ms": event.get("duration_ms"),
+                }
+
+
+_workers: dict[int, ClaudeWorker] = {}
 
-    if not result_data:
-        result_data = {"result": accumulated_text, "session_id": session_id}
 
-    return result_data
+def _get_worker(chat_id: int) -> ClaudeWorker:
+    if chat_id not in _workers:
+        _workers[chat_id] = ClaudeWorker()
+    return _workers[chat_id]
 
 
 # ---------------------------------------------------------------------------
@@ -717,23 +1159,63 @@ def _split_message(text: str, limit: int = MAX_MSG_LEN) -> list[str]:
     if len(text) <= limit:
         return [text]
 
+    # Walk the string with a moving start offset instead of re-slicing the
+    # tail each iteration — the old `text = text[cut:]` loop copied the
+    # remainder every round, making long outputs O(n^2).
     chunks: list[str] = []
-    while text:
-        if len(text) <= limit:
-            chunks.append(text)
-            break
-        cut = text.rfind("\n\n", 0, limit)
-        if cut < limit // 4:
-            cut = text.rfind("\n", 0, limit)
-        if cut < limit // 4:
-            cut = text.rfind(" ", 0, limit)
-        if cut < limit // 4:
-            cut = limit
-        chunks.append(text[:cut])
-        text = text[cut:].lstrip("\n")
+    start = 0
+    n = len(text)
+    while n - start > limit:
+        end = start + limit
+        # Prefer paragraph, then line, then word boundaries; hard cut last.
+        cut = text.rfind("\n\n", start, end)
+        if cut - start < limit // 4:
+            cut = text.rfind("\n", start, end)
+        if cut - start < limit // 4:
+            cut = text.rfind(" ", start, end)
+        if cut - start < limit // 4:
+            cut = end
+        chunks.append(text[start:cut])
+        while cut < n and text[cut] == "\n":  # eat leading newlines
+            cut += 1
+        start = cut
+    if start < n:
+        chunks.append(text[start:])
     return chunks
 
 
+# Per-chat buffers of short confirmation texts awaiting a coalesced send.
+_reply_buffers: dict[int, list[str]] = {}
+_reply_tasks: dict[int, asyncio.Task] = {}
+_COALESCE_DELAY = 0.3  # seconds
+
+
+async def _reply_coalesced(chat, text: str) -> None:
+    """Batch short confirmation replies into one message.
+
+    Command bursts (e.g. /model then /sudo from the menu) otherwise cost
+    one HTTPS round-trip to the Bot API each; texts enqueued within the
+    window are joined and sent as a single message.
+    """
+    buf = _reply_buffers.get(chat.id)
+    if buf is not None:
+        buf.append(text)
+        return
+    _reply_buffers[chat.id] = [text]
+
+    async def _flush():
+        await asyncio.sleep(_COALESCE_DELAY)
+        texts = _reply_buffers.pop(chat.id, [])
+        _reply_tasks.pop(chat.id, None)
+        for chunk in _split_message("\n\n".join(texts)):
+            try:
+                await chat.send_message(chunk)
+            except Exception as e:
+                logger.warning("Coalesced reply failed: %s", e)
+
+    _reply_tasks[chat.id] = asyncio.create_task(_flush())
+
+
 def _format_result(data: dict) -> str:
     if data.get("is_error"):
         return f"Error:\n{data.get('result', 'unknown error')}"
@@ -742,7 +1224,9 @@ def _format_result(data: dict) -> str:
     if not result:
         return "(done — no output)"
 
-    parts = [result]
+    if not (data.get("cost_usd") or data.get("num_turns") or data.get("duration_ms")):
+        return result  # common case — no meta, nothing to append
+
     meta: list[str] = []
     if data.get("cost_usd"):
         meta.append(f"${data['cost_usd']:.4f}")
@@ -751,10 +1235,7 @@ def _format_result(data: dict) -> str:
     if data.get("duration_ms"):
         secs = data["duration_ms"] / 1000
         meta.append(f"{secs:.1f}s")
-    if meta:
-        parts.append(f"\n[{' | '.join(meta)}]")
-
-    return "".join(parts)
+    return f"{result}\n[{' | '.join(meta)}]"
 
 
 _IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp"}
@@ -784,6 +1265,23 @@ def _extract_file_paths(text: str) -> tuple[str, list[Path]]:
     return text, files
 
 
+# Any character _md_to_tg_html or Telegram's HTML parser could act on; a
+# chunk with none of these renders identically as plain text, so the
+# conversion and parse_mode round-trip can be skipped.
+_MD_SPECIAL_RE = re.compile(r"[`*\[#~<>&]")
+
+
+async def _send_chunk(chat, chunk: str) -> None:
+    """Send one response chunk, converting markdown only when present."""
+    if not _MD_SPECIAL_RE.search(chunk):
+        await chat.send_message(chunk)
+        return
+    try:
+        await chat.send_message(_md_to_tg_html(chunk), parse_mode="HTML")
+    except Exception:
+        await chat.send_message(chunk)
+
+
 def _md_to_tg_html(text: str) -> str:
     """Convert markdown to Telegram-compatible HTML.
 
@@ -832,17 +1330,40 @@ def _md_to_tg_html(text: str) -> str:
     return text
 
 
-async def _keep_typing(chat, stop: asyncio.Event) -> None:
-    """Send typing action every 4s until stopped."""
-    while not stop.is_set():
-        try:
-            await chat.send_action(ChatAction.TYPING)
-        except Exception:
-            pass
-        try:
-            await asyncio.wait_for(stop.wait(), timeout=4)
-        except asyncio.TimeoutError:
-            pass
+# Chats with an in-flight request that should show the typing indicator,
+# mapped to when they became busy. One global heartbeat task services all
+# of them — N busy chats used to mean N timer tasks each waking every 4s.
+_typing_chats: dict[int, float] = {}
+
+_TYPING_GRACE = 0.8  # skip the action entirely for sub-second turns
+
+
+async def _typing_heartbeat(bot) -> None:
+    """Broadcast the typing action every 4s to all currently busy chats."""
+    try:
+        while True:
+            await asyncio.sleep(4)
+            cutoff = time.monotonic() - _TYPING_GRACE
+            targets = [c for c, since in _typing_chats.items() if since < cutoff]
+            if not targets:
+                continue
+            results = await asyncio.gather(
+                *(bot.send_chat_action(c, ChatAction.TYPING) for c in targets),
+                return_exceptions=True,
+            )
+            # Back off when Telegram rate-limits us — hammering on during
+            # the penalty window only extends it and steals quota from
+            # real replies.
+            penalty = max(
+                (r.retry_after for r in results if isinstance(r, RetryAfter)),
+                default=0,
+            )
+            if penalty:
+                await asyncio.sleep(penalty)
+    except asyncio.CancelledError:
+        # Shutdown — exit quietly so the awaiting side never sees a stray
+        # "exception was never retrieved" from this task.
+        return
 
 
 # ---------------------------------------------------------------------------
@@ -855,20 +1376,32 @@ def _btn(text: str, data: str) -> InlineKeyboardButton:
 
 
 def _kb_main_menu(chat_id: int) -> InlineKeyboardMarkup:
+    # Key the cache on the only thing that varies: the recents row.
+    return _kb_main_menu_cached(tuple(_recents.get(chat_id, [])[:3]))
+
+
+# The category rows never change — build the button objects exactly once
+# and share them across every cached menu variant.
+_STATIC_MAIN_ROWS = (
+    [_btn("🛠 Skills", "cat:skills"), _btn("💼 Work", "cat:work")],
+    [_btn("📂 Git", "cat:git"), _btn("⚙ Settings", "cat:settings")],
+    [_btn("📋 Session", "cat:session")],
+)
+
+
+@functools.lru_cache(maxsize=64)
+def _kb_main_menu_cached(recents: tuple[str, ...]) -> InlineKeyboardMarkup:
     rows: list[list[InlineKeyboardButton]] = []
 
     # Recents row
-    recents = _recents.get(chat_id, [])
     if recents:
-        rows.append([_btn(f"⚡ {r}", f"sk:{r}") for r in recents[:3]])
+        rows.append([_btn(f"⚡ {r}", f"sk:{r}") for r in recents])
 
-    # Category buttons
-    rows.append([_btn("🛠 Skills", "cat:skills"), _btn("💼 Work", "cat:work")])
-    rows.append([_btn("📂 Git", "cat:git"), _btn("⚙ Settings", "cat:settings")])
-    rows.append([_btn("📋 Session", "cat:session")])
+    rows.extend(_STATIC_MAIN_ROWS)
     return InlineKeyboardMarkup(rows)
 
 
+@functools.lru_cache(maxsize=None)
 def _kb_skill_groups() -> InlineKeyboardMarkup:
     """Layer 2: show plugin groups as buttons."""
     groups = _skills_by_group()
@@ -887,6 +1420,7 @@ def _kb_skill_groups() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(rows)
 
 
+@functools.lru_cache(maxsize=None)
 def _kb_skill_group(plugin: str, back_target: str = "cat:skills") -> InlineKeyboardMarkup:
     """Layer 3: show individual skills within a plugin group."""
     groups = _skills_by_group()
@@ -904,6 +1438,7 @@ def _kb_skill_group(plugin: str, back_target: str = "cat:skills") -> InlineKeybo
     return InlineKeyboardMarkup(rows)
 
 
+@functools.lru_cache(maxsize=None)
 def _kb_work_groups() -> InlineKeyboardMarkup:
     """Work skills layer 2: knowledge-work plugin categories."""
     rows: list[list[InlineKeyboardButton]] = []
@@ -920,6 +1455,7 @@ def _kb_work_groups() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(rows)
 
 
+@functools.lru_cache(maxsize=None)
 def _kb_git() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [_btn("status", "git:status"), _btn("diff", "git:diff"), _btn("log", "git:log")],
@@ -938,6 +1474,11 @@ def _kb_settings() -> InlineKeyboardMarkup:
             model_label = alias
             break
     sudo = "ON" if _settings.get("skip_permissions") == "1" else "OFF"
+    return _kb_settings_cached(model_label, sudo)
+
+
+@functools.lru_cache(maxsize=16)
+def _kb_settings_cached(model_label: str, sudo: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [_btn(f"Model: {model_label}", "set:model")],
         [_btn(f"Sudo: {sudo}", "set:sudo")],
@@ -947,7 +1488,11 @@ def _kb_settings() -> InlineKeyboardMarkup:
 
 
 def _kb_model_picker() -> InlineKeyboardMarkup:
-    current = _settings.get("model", "")
+    return _kb_model_picker_cached(_settings.get("model", ""))
+
+
+@functools.lru_cache(maxsize=16)
+def _kb_model_picker_cached(current: str) -> InlineKeyboardMarkup:
     rows = []
     for alias, full in MODEL_ALIASES.items():
         check = " ✓" if full == current else ""
@@ -957,6 +1502,7 @@ def _kb_model_picker() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(rows)
 
 
+@functools.lru_cache(maxsize=None)
 def _kb_session() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [_btn("📊 Info", "ses:info"), _btn("🆕 New", "ses:new")],
@@ -966,6 +1512,12 @@ def _kb_session() -> InlineKeyboardMarkup:
     ])
 
 
+# Prompts shown on the last rendered history page, so the resume handler
+# can echo one back without re-scanning the sessions tree. Bounded FIFO.
+_recent_prompts: dict[str, str] = {}
+_RECENT_PROMPTS_MAX = 200
+
+
 def _kb_session_history(
     sessions: list[dict],
     current_sid: str | None = None,
@@ -974,15 +1526,32 @@ def _kb_session_history(
     page_size: int = 5,
 ) -> InlineKeyboardMarkup:
     """Show recent Claude Code sessions as resumable buttons with pagination."""
-    rows: list[list[InlineKeyboardButton]] = []
+    entries: list[tuple[str, str, str]] = []
     for s in sessions:
         prompt = s["prompt"]
+        _recent_prompts[s["session_id"]] = prompt
+        while len(_recent_prompts) > _RECENT_PROMPTS_MAX:
+            del _recent_prompts[next(iter(_recent_prompts))]
+        entries.append((s["session_id"], prompt, s["mtime"].strftime("%m/%d %H:%M")))
+    return _kb_history_cached(tuple(entries), current_sid, offset, total, page_size)
+
+
+@functools.lru_cache(maxsize=64)
+def _kb_history_cached(
+    entries: tuple[tuple[str, str, str], ...],
+    current_sid: str | None,
+    offset: int,
+    total: int,
+    page_size: int,
+) -> InlineKeyboardMarkup:
+    # Bouncing between pages of an unchanged session list reuses the
+    # markup instead of reallocating every button.
+    rows: list[list[InlineKeyboardButton]] = []
+    for sid, prompt, date in entries:
         if len(prompt) > 40:
             prompt = prompt[:37] + "..."
-        date = s["mtime"].strftime("%m/%d %H:%M")
-        active = " ●" if s["session_id"] == current_sid else ""
-        label = f"{prompt} ({date}){active}"
-        rows.append([_btn(label, f"sr:{s['session_id']}")])
+        active = " ●" if sid == current_sid else ""
+        rows.append([_btn(f"{prompt} ({date}){active}", f"sr:{sid}")])
 
     # Pagination row
     nav: list[InlineKeyboardButton] = []
@@ -997,6 +1566,7 @@ def _kb_session_history(
     return InlineKeyboardMarkup(rows)
 
 
+@functools.lru_cache(maxsize=None)
 def _kb_cancel() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([[_btn("Cancel", "cancel")]])
 
@@ -1045,85 +1615,122 @@ async def _run_and_send(
     placeholder=None,
     vps_override: dict | None = None,
 ) -> None:
-    """Run Claude with streaming and progressively update the placeholder.
+    """Run Claude through the chat's persistent worker and progressively
+    update the placeholder.
 
-    Uses stream-json to show partial content as it arrives (rate-limited
-    to one edit every 3s to avoid Telegram API throttling).  Falls back
-    to non-streaming run_claude if streaming produces no events.
+    Streamed content is shown as it arrives (rate-limited to one edit
+    every 3s to avoid Telegram API throttling).
     *vps_override* changes the working directory and/or claude binary.
     """
     sid = None if new_session else session.session_id
     _wd = vps_override.get("work_dir") if vps_override else None
     _cb = vps_override.get("claude_bin") if vps_override else None
 
-    last_edit = [0.0]
-    last_text = [""]
+    # Streaming state: "ph" is the message currently being grown, "done"
+    # the content already finalized into earlier rolled-over messages.
+    _STREAM_LIMIT = 3500
+    state = {"ph": placeholder, "done": "", "last_edit": 0.0, "last_text": ""}
 
     async def _on_text(text: str):
         now = time.monotonic()
-        if now - last_edit[0] < 3.0:
+        if text == state["last_text"]:
             return
-        if text == last_text[0]:
-            return
-        last_edit[0] = now
-        last_text[0] = text
-        if placeholder:
-            preview = text[:MAX_MSG_LEN - 30]
-            if len(text) > MAX_MSG_LEN - 30:
-                preview += "\n\n\u2026 streaming"
+
+        # Roll over into a fresh message once the current one fills up, so
+        # long responses keep streaming instead of truncating at 4096.
+        while state["ph"] and len(text) - len(state["done"]) > _STREAM_LIMIT:
+            base = len(state["done"])
+            cut = text.rfind("\n", base, base + _STREAM_LIMIT)
+            if cut - base < _STREAM_LIMIT // 4:
+                cut = base + _STREAM_LIMIT
+            piece = text[base:cut]
             try:
-                await placeholder.edit_text(preview)
+                await state["ph"].edit_text(piece)
             except Exception:
                 pass
+            state["done"] += piece
+            state["last_edit"] = now
+            state["last_text"] = text
+            try:
+                state["ph"] = await chat.send_message("\u2026")
+            except Exception:
+                state["ph"] = None
+
+        if now - state["last_edit"] < 3.0:
+            return
+        state["last_edit"] = now
+        state["last_text"] = text
+        if state["ph"]:
+            preview = text[len(state["done"]):]
+            if preview:
+                try:
+                    await state["ph"].edit_text(preview)
+                except Exception:
+                    pass
 
-    result = await run_claude_streaming(
+    worker = _get_worker(chat.id)
+    result = await worker.send(
         prompt, session_id=sid, work_dir=_wd, claude_bin=_cb,
         on_text=_on_text,
     )
 
     if result.get("is_error") and sid and not result.get("timed_out"):
         logger.warning("Session %s failed, retrying fresh", sid)
-        result = await run_claude_streaming(
+        worker.close()
+        result = await worker.send(
             prompt, session_id=None, work_dir=_wd, claude_bin=_cb,
         )
 
     new_sid = result.get("session_id")
     if new_sid:
+        sid_changed = new_sid != session.session_id
         if not session.session_id or new_session:
-            session.created_at = datetime.now().strftime("%Y-%m-%d %H:%M")
+            session.created_at = _now_minute_str()
         session.session_id = new_sid
         session.message_count += 1
-        _save_sessions()
+        if sid_changed:
+            # Steady-state turns only bump message_count, which is
+            # cosmetic and recomputable — persist only when the resume
+            # target actually moved.
+            _save_sessions()
 
     response = _format_result(result)
     response, attachments = _extract_file_paths(response)
+
+    # If streaming rolled over, the earlier messages already hold a verbatim
+    # prefix of the response — only render the remainder into the current
+    # message. On a mismatch (error, retry) fall back to the full text.
+    placeholder = state["ph"]
+    done = state["done"]
+    if done and response.startswith(done):
+        response = response[len(done):].lstrip("\n") or "✓"
+
     chunks = _split_message(response)
 
     # Edit the placeholder with the first chunk, send the rest as new messages
     if placeholder and chunks:
         first = chunks[0]
-        html_first = _md_to_tg_html(first)
-        try:
-            await placeholder.edit_text(html_first, parse_mode="HTML")
-        except Exception:
+        if not _MD_SPECIAL_RE.search(first):
+            # Plain text — conversion would be a no-op, send it once as-is
             try:
                 await placeholder.edit_text(first)
             except Exception:
                 await chat.send_message(first)
-
-        for chunk in chunks[1:]:
-            html_chunk = _md_to_tg_html(chunk)
+        else:
+            html_first = _md_to_tg_html(first)
             try:
-                await chat.send_message(html_chunk, parse_mode="HTML")
+                await placeholder.edit_text(html_first, parse_mode="HTML")
             except Exception:
-                await chat.send_message(chunk)
+                try:
+                    await placeholder.edit_text(first)
+                except Exception:
+                    await chat.send_message(first)
+
+        for chunk in chunks[1:]:
+            await _send_chunk(chat, chunk)
     else:
         for chunk in (chunks or []):
-            html_chunk = _md_to_tg_html(chunk)
-            try:
-                await chat.send_message(html_chunk, parse_mode="HTML")
-            except Exception:
-                await chat.send_message(chunk)
+            await _send_chunk(chat, chunk)
 
     # Send extracted file attachments
     for fpath in attachments:
@@ -1137,6 +1744,19 @@ async def _run_and_send(
             logger.warning("Failed to send file %s: %s", fpath, e)
 
 
+# Per-chat locks: chats run fully concurrently against each other (PTB
+# dispatches updates concurrently), but turns within one chat are strictly
+# serialized. The lock also closes the busy-flag check-then-set race when
+# two updates for the same chat arrive back to back.
+_chat_locks: dict[int, asyncio.Lock] = {}
+
+
+def _get_chat_lock(chat_id: int) -> asyncio.Lock:
+    if chat_id not in _chat_locks:
+        _chat_locks[chat_id] = asyncio.Lock()
+    return _chat_locks[chat_id]
+
+
 async def _relay(
     update: Update,
     prompt: str,
@@ -1147,8 +1767,9 @@ async def _relay(
     """Send prompt to Claude Code, reply with result. Queues if busy."""
     chat = update.effective_chat
     session = _get_session(chat.id)
+    lock = _get_chat_lock(chat.id)
 
-    if session.busy:
+    if lock.locked():
         session.queue.append(prompt)
         n = len(session.queue)
         msg = f"Queued ({n} pending)."
@@ -1158,36 +1779,47 @@ async def _relay(
             await chat.send_message(msg)
         return
 
-    session.busy = True
+    async with lock:
+        session.busy = True
+        session.active_task = asyncio.current_task()
 
-    # Send a placeholder that gets edited with the result
-    # Show which VPS route is being used in the placeholder
-    vps_name = ""
-    if vps_override:
-        for name, cfg in _vps_routes.items():
-            if cfg is vps_override:
-                vps_name = f" [{name}]"
-                break
-    placeholder = await chat.send_message(f"Working...{vps_name}")
+        # Send a placeholder that gets edited with the result
+        # Show which VPS route is being used in the placeholder
+        vps_name = ""
+        if vps_override:
+            for name, cfg in _vps_routes.items():
+                if cfg is vps_override:
+                    vps_name = f" [{name}]"
+                    break
+        placeholder = await chat.send_message(f"Working...{vps_name}")
 
-    try:
-        await _run_and_send(
-            chat, session, prompt,
-            new_session=new_session, placeholder=placeholder,
-            vps_override=vps_override,
-        )
+        try:
+            await _run_and_send(
+                chat, session, prompt,
+                new_session=new_session, placeholder=placeholder,
+                vps_override=vps_override,
+            )
 
-        # Drain queue — process messages that arrived while busy
-        while session.queue:
-            queued = session.queue[:]
+            # Drain queue — process messages that arrived while busy
+            while session.queue:
+                queued = session.queue[:]
+                session.queue.clear()
+                combined = "\n---\n".join(queued)
+                ph = await chat.send_message("Working...")
+                await _run_and_send(chat, session, combined, placeholder=ph,
+                                    vps_override=vps_override)
+
+        except asyncio.CancelledError:
+            # User hit Cancel — the subprocess is already killed on the way
+            # up; acknowledge and swallow so PTB doesn't log a crash.
             session.queue.clear()
-            combined = "\n---\n".join(queued)
-            ph = await chat.send_message("Working...")
-            await _run_and_send(chat, session, combined, placeholder=ph,
-                                vps_override=vps_override)
-
-    finally:
-        session.busy = False
+            try:
+                await placeholder.edit_text("✖ Cancelled.")
+            except Exception:
+                pass
+        finally:
+            session.busy = False
+            session.active_task = None
 
 
 # ---------------------------------------------------------------------------
@@ -1196,6 +1828,23 @@ async def _relay(
 
 MENU_TEXT = "Claude Code Bridge — tap a button or type a message."
 
+# Last rendered (text, markup) per menu message, so identical re-renders
+# can be skipped entirely. Keyed by message id; state changes (settings,
+# recents) produce a different key. Edits that bypass _nav_reply must go
+# through _edit_direct so the stale entry is dropped.
+_last_render: dict[int, tuple[str, str]] = {}
+
+
+async def _edit_direct(query, text: str, **kwargs) -> None:
+    """Edit a menu message outside _nav_reply.
+
+    Drops the message's no-op cache entry first — otherwise the next
+    _nav_reply render that matches the pre-edit content would be wrongly
+    skipped and the button would appear dead.
+    """
+    _last_render.pop(query.message.message_id, None)
+    await query.edit_message_text(text, **kwargs)
+
 
 async def _nav_reply(
     query,
@@ -1215,10 +1864,39 @@ async def _nav_reply(
         await query.message.chat.send_message(
             text, reply_markup=reply_markup, parse_mode=parse_mode,
         )
-    else:
-        await query.edit_message_text(
-            text, reply_markup=reply_markup, parse_mode=parse_mode,
-        )
+        return
+
+    # Skip edits that would not change anything — mashing the same button
+    # otherwise costs a full API round-trip per tap (which Telegram rejects
+    # with "message is not modified" anyway).
+    mid = query.message.message_id
+    key = (text, reply_markup.to_json() if reply_markup else "")
+    if _last_render.get(mid) == key:
+        return
+    await query.edit_message_text(
+        text, reply_markup=reply_markup, parse_mode=parse_mode,
+    )
+    if len(_last_render) > 256:
+        _last_render.clear()
+    _last_render[mid] = key
+
+
+# Git button tables — immediate actions relay straight away, the rest arm
+# a pending input with the given label. Built once; the callback handler
+# used to rebuild both dicts on every git: tap.
+_IMMEDIATE_GIT = {
+    "status": "Run `git status` and show the output concisely.",
+    "diff": "Run `git diff` and show the output. If large, summarize key changes.",
+    "log": "Run `git log --oneline -n 10` and show the output.",
+    "undo": "Run `git reset --soft HEAD~1` and show result.",
+}
+
+_GIT_INPUT_PROMPTS = {
+    "commit": "Commit message (or leave blank):",
+    "branch": "Branch name (or blank to list all):",
+    "stash": "Stash operation (list/push/pop/drop):",
+    "pr": "PR description (or blank for auto):",
+}
 
 
 @_auth_callback
@@ -1229,9 +1907,14 @@ async def handle_callback(update: Update, _ctx: ContextTypes.DEFAULT_TYPE) -> No
     chat_id = update.effective_chat.id
     session = _get_session(chat_id)
 
+    # One scan splits the callback data; branches below compare the short
+    # prefix instead of each re-scanning the full string with startswith
+    # and re-slicing with magic offsets.
+    prefix, _, arg = data.partition(":")
+
     # Allow navigation and settings even if session is busy
     # --- Navigation (all use _nav_reply for busy-aware responses) ---
-    if data == "menu" or data == "back":
+    if data in ("menu", "back"):
         await _nav_reply(query, MENU_TEXT, _kb_main_menu(chat_id), session)
         return
 
@@ -1239,92 +1922,77 @@ async def handle_callback(update: Update, _ctx: ContextTypes.DEFAULT_TYPE) -> No
         return
 
     if data == "cancel":
-        session.pending_skill = None
+        session.pending_action = None
+        if session.busy and session.active_task:
+            # Abort the in-flight Claude turn — superseded work just burns
+            # CPU and quota.
+            session.active_task.cancel()
+            return
         await _nav_reply(query, MENU_TEXT, _kb_main_menu(chat_id), session)
         return
 
     # --- Categories ---
-    if data == "cat:skills":
-        await _nav_reply(query, "🛠 *Skills*\nChoose a category.", _kb_skill_groups(), session, parse_mode="Markdown")
-        return
-
-    if data == "cat:work":
-        await _nav_reply(query, "💼 *Work Skills*\nChoose a category.", _kb_work_groups(), session, parse_mode="Markdown")
-        return
-
-    if data.startswith("sg:"):
-        plugin = data[3:]
-        label = _group_label(plugin)
-        await _nav_reply(
-            query,
-            f"{label}\nTap to activate, then type your message.",
-            _kb_skill_group(plugin, back_target="cat:skills"),
-            session,
-        )
+    if prefix == "cat":
+        if arg == "skills":
+            await _nav_reply(query, "🛠 *Skills*\nChoose a category.", _kb_skill_groups(), session, parse_mode="Markdown")
+        elif arg == "work":
+            await _nav_reply(query, "💼 *Work Skills*\nChoose a category.", _kb_work_groups(), session, parse_mode="Markdown")
+        elif arg == "git":
+            await _nav_reply(query, "📂 *Git*", _kb_git(), session, parse_mode="Markdown")
+        elif arg == "settings":
+            await _nav_reply(query, "⚙ *Settings*", _kb_settings(), session, parse_mode="Markdown")
+        elif arg == "session":
+            await _nav_reply(query, "📋 *Session*", _kb_session(), session, parse_mode="Markdown")
         return
 
-    if data.startswith("wg:"):
-        plugin = data[3:]
-        label = _group_label(plugin)
+    # --- Skill group drill-down (sg: from Skills, wg: from Work) ---
+    if prefix in ("sg", "wg"):
+        label = _group_label(arg)
+        back_target = "cat:skills" if prefix == "sg" else "cat:work"
         await _nav_reply(
             query,
             f"{label}\nTap to activate, then type your message.",
-            _kb_skill_group(plugin, back_target="cat:work"),
+            _kb_skill_group(arg, back_target=back_target),
             session,
         )
         return
 
-    if data == "cat:git":
-        await _nav_reply(query, "📂 *Git*", _kb_git(), session, parse_mode="Markdown")
-        return
-
-    if data == "cat:settings":
-        await _nav_reply(query, "⚙ *Settings*", _kb_settings(), session, parse_mode="Markdown")
-        return
-
-    if data == "cat:session":
-        await _nav_reply(query, "📋 *Session*", _kb_session(), session, parse_mode="Markdown")
-        return
-
     # --- Settings ---
-    if data == "set:model":
-        await _nav_reply(query, "⚙ *Select model:*", _kb_model_picker(), session, parse_mode="Markdown")
-        return
-
-    if data.startswith("set:model:"):
-        choice = data[len("set:model:"):]
-        if choice == "default":
-            _settings.pop("model", None)
-        else:
-            _settings["model"] = MODEL_ALIASES.get(choice, choice)
-        _save_settings()
-        await _nav_reply(
-            query,
-            f"⚙ Model set to *{choice}*",
-            _kb_settings(),
-            session,
-            parse_mode="Markdown",
-        )
-        return
-
-    if data == "set:sudo":
-        if _settings.get("skip_permissions") == "1":
-            _settings["skip_permissions"] = "0"
-        else:
-            _settings["skip_permissions"] = "1"
-        _save_settings()
-        state = "ON" if _settings.get("skip_permissions") == "1" else "OFF"
-        await _nav_reply(
-            query,
-            f"⚙ Sudo is now *{state}*",
-            _kb_settings(),
-            session,
-            parse_mode="Markdown",
-        )
+    if prefix == "set":
+        if arg == "model":
+            await _nav_reply(query, "⚙ *Select model:*", _kb_model_picker(), session, parse_mode="Markdown")
+        elif arg.startswith("model:"):
+            choice = arg[len("model:"):]
+            if choice == "default":
+                _settings.pop("model", None)
+            else:
+                _settings["model"] = MODEL_ALIASES.get(choice, choice)
+            _save_settings()
+            await _nav_reply(
+                query,
+                f"⚙ Model set to *{choice}*",
+                _kb_settings(),
+                session,
+                parse_mode="Markdown",
+            )
+        elif arg == "sudo":
+            if _settings.get("skip_permissions") == "1":
+                _settings["skip_permissions"] = "0"
+            else:
+                _settings["skip_permissions"] = "1"
+            _save_settings()
+            state = "ON" if _settings.get("skip_permissions") == "1" else "OFF"
+            await _nav_reply(
+                query,
+                f"⚙ Sudo is now *{state}*",
+                _kb_settings(),
+                session,
+                parse_mode="Markdown",
+            )
         return
 
     # --- Session Info (safe to view while busy) ---
-    if data == "ses:info":
+    if data == "ses:info":  # handled before the other ses: actions below
         s = _get_session(chat_id)
         if not s.session_id:
             await _nav_reply(query, "No active session. Send a message to start one.", _kb_main_menu(chat_id), session)
@@ -1346,12 +2014,14 @@ async def handle_callback(update: Update, _ctx: ContextTypes.DEFAULT_TYPE) -> No
         return
 
     # --- Session history & resume ---
-    if data == "ses:history" or data.startswith("sh:"):
+    if data == "ses:history" or prefix == "sh":
         page_size = 5
-        offset = 0
-        if data.startswith("sh:"):
-            offset = max(0, int(data[3:]))
-        sessions_list, total = _scan_cc_sessions(limit=page_size, offset=offset)
+        offset = max(0, int(arg)) if prefix == "sh" else 0
+        # Directory scan + file reads run off the loop — with many
+        # sessions this is tens of milliseconds of blocking I/O.
+        sessions_list, total = await asyncio.to_thread(
+            _scan_cc_sessions, limit=page_size, offset=offset
+        )
         if not sessions_list:
             await _nav_reply(query, "No sessions found.", _kb_session(), session)
             return
@@ -1364,18 +2034,15 @@ async def handle_callback(update: Update, _ctx: ContextTypes.DEFAULT_TYPE) -> No
         )
         return
 
-    if data.startswith("sr:"):
-        target_sid = data[3:]
+    if prefix == "sr":
+        target_sid = arg
         session.session_id = target_sid
-        session.created_at = datetime.now().strftime("%Y-%m-%d %H:%M")
+        session.created_at = _now_minute_str()
         session.message_count = 0
         _save_sessions()
-        # Find the prompt for display
-        prompt_text = target_sid[:16]
-        for s in _scan_cc_sessions(limit=20)[0]:
-            if s["session_id"] == target_sid:
-                prompt_text = s["prompt"]
-                break
+        # The prompt was recorded when the history page was rendered —
+        # no need to rescan the sessions tree just to echo it back.
+        prompt_text = _recent_prompts.get(target_sid, target_sid[:16])
         await _nav_reply(
             query,
             f"📜 Resumed session:\n_{prompt_text}_\n`{target_sid[:16]}...`",
@@ -1385,14 +2052,25 @@ async def handle_callback(update: Update, _ctx: ContextTypes.DEFAULT_TYPE) -> No
         )
         return
 
+    # Recents buttons store git actions under "sk:git:<action>" tags —
+    # they are git buttons, not skills, so hand them to the git branch
+    # below instead of the skill existence check.
+    if prefix == "sk" and arg.startswith("git:"):
+        prefix, arg = "git", arg[4:]
+
     # Clear any pending skill when navigating menus
-    if data not in ("cancel",) and not data.startswith("sk:") and not data.startswith("sg:") and not data.startswith("wg:"):
-        session.pending_skill = None
+    if prefix not in ("sk", "sg", "wg"):
+        session.pending_action = None
 
     # --- Skill activation (nonblocking — just sets pending state) ---
-    if data.startswith("sk:"):
-        skill_name = data[3:]
-        session.pending_skill = skill_name
+    if prefix == "sk":
+        skill_name = arg
+        if skill_name not in _skills_by_name():
+            # Stale keyboard from before a plugin change — don't arm a
+            # slash command that no longer exists.
+            await _nav_reply(query, f"Skill `{skill_name}` is no longer installed.", _kb_main_menu(chat_id), session, parse_mode="Markdown")
+            return
+        session.pending_action = PendingAction("skill", skill_name)
         await _nav_reply(
             query,
             f"🛠 *{skill_name}*\nType your message (it will be sent as `/{skill_name} <your text>`).",
@@ -1403,30 +2081,18 @@ async def handle_callback(update: Update, _ctx: ContextTypes.DEFAULT_TYPE) -> No
         return
 
     # --- Git commands (queue if busy) ---
-    if data.startswith("git:"):
-        action = data[4:]
+    if prefix == "git":
+        action = arg
         # Immediate commands (no input needed)
-        immediate = {
-            "status": "Run `git status` and show the output concisely.",
-            "diff": "Run `git diff` and show the output. If large, summarize key changes.",
-            "log": "Run `git log --oneline -n 10` and show the output.",
-            "undo": "Run `git reset --soft HEAD~1` and show result.",
-        }
-        if action in immediate:
+        if action in _IMMEDIATE_GIT:
             _record_recent(chat_id, f"git:{action}")
-            await _relay(update, immediate[action])
+            await _relay(update, _IMMEDIATE_GIT[action])
             return
 
         # Commands needing input
-        prompts = {
-            "commit": ("Commit message (or leave blank):", "git:commit"),
-            "branch": ("Branch name (or blank to list all):", "git:branch"),
-            "stash": ("Stash operation (list/push/pop/drop):", "git:stash"),
-            "pr": ("PR description (or blank for auto):", "git:pr"),
-        }
-        if action in prompts:
-            label, tag = prompts[action]
-            session.pending_skill = tag  # reuse pending_skill for git too
+        if action in _GIT_INPUT_PROMPTS:
+            label = _GIT_INPUT_PROMPTS[action]
+            session.pending_action = PendingAction("git", action)
             await _nav_reply(
                 query,
                 f"📂 *git {action}*\n{label}",
@@ -1437,11 +2103,18 @@ async def handle_callback(update: Update, _ctx: ContextTypes.DEFAULT_TYPE) -> No
             return
 
     # --- Session commands ---
-    if data.startswith("ses:"):
-        action = data[4:]
+    if prefix == "ses":
+        action = arg
         if action == "new":
-            old = _get_session(chat_id).session_id
-            _sessions[chat_id] = Session()
+            s = _get_session(chat_id)
+            old = s.session_id
+            if s.busy or _get_chat_lock(chat_id).locked():
+                # An in-flight turn still owns this object — give it an
+                # orphan to finish on; resetting in place would let the
+                # turn's completion write the old session id back.
+                _sessions[chat_id] = Session()
+            else:
+                s.reset()
             _save_sessions()
             msg = "🆕 New session started."
             if old:
@@ -1451,45 +2124,48 @@ async def handle_callback(update: Update, _ctx: ContextTypes.DEFAULT_TYPE) -> No
 
         if action == "compact":
             s = _get_session(chat_id)
-            if s.busy:
+            lock = _get_chat_lock(chat_id)
+            if s.busy or lock.locked():
                 await update.effective_chat.send_message(
                     "Cannot compact while a request is in progress."
                 )
                 return
-            await query.edit_message_text("📦 Compacting session...")
+            await _edit_direct(query, "📦 Compacting session...")
             if not s.session_id:
-                await query.edit_message_text("No active session to compact.", reply_markup=_kb_main_menu(chat_id))
+                await _edit_direct(query, "No active session to compact.", reply_markup=_kb_main_menu(chat_id))
+                return
+            async with lock:
+                s.busy = True
+                try:
+                    summary = await run_claude(
+                        "Provide a concise summary of our entire conversation so far: "
+                        "key decisions, files modified, current state, and pending work.",
+                        session_id=s.session_id,
+                    )
+                    summary_text = summary.get("result", "")
+                    if not summary_text:
+                        await _edit_direct(query, "Failed to generate summary.", reply_markup=_kb_main_menu(chat_id))
+                        return
+                    fresh = await run_claude(
+                        f"CONTEXT FROM PREVIOUS SESSION:\n\n{summary_text}\n\n"
+                        "Acknowledged. I have the context. Ready to continue.",
+                    )
+                    old_count = s.message_count
+                    new_s = Session(
+                        session_id=fresh.get("session_id"),
+                        created_at=_now_minute_str(),
+                        message_count=1,
+                    )
+                    _sessions[chat_id] = new_s
+                    _save_sessions()
+                    await _edit_direct(
+                        query,
+                        f"📦 Session compacted ({old_count} msgs → fresh start).",
+                        reply_markup=_kb_main_menu(chat_id),
+                    )
+                finally:
+                    s.busy = False
                 return
-            s.busy = True
-            try:
-                summary = await run_claude(
-                    "Provide a concise summary of our entire conversation so far: "
-                    "key decisions, files modified, current state, and pending work.",
-                    session_id=s.session_id,
-                )
-                summary_text = summary.get("result", "")
-                if not summary_text:
-                    await query.edit_message_text("Failed to generate summary.", reply_markup=_kb_main_menu(chat_id))
-                    return
-                fresh = await run_claude(
-                    f"CONTEXT FROM PREVIOUS SESSION:\n\n{summary_text}\n\n"
-                    "Acknowledged. I have the context. Ready to continue.",
-                )
-                old_count = s.message_count
-                new_s = Session(
-                    session_id=fresh.get("session_id"),
-                    created_at=datetime.now().strftime("%Y-%m-%d %H:%M"),
-                    message_count=1,
-                )
-                _sessions[chat_id] = new_s
-                _save_sessions()
-                await query.edit_message_text(
-                    f"📦 Session compacted ({old_count} msgs → fresh start).",
-                    reply_markup=_kb_main_menu(chat_id),
-                )
-            finally:
-                s.busy = False
-            return
 
         if action == "clear":
             _sessions.pop(chat_id, None)
@@ -1551,8 +2227,15 @@ async def cmd_help(update: Update, _ctx: ContextTypes.DEFAULT_TYPE):
 
 @_auth
 async def cmd_new(update: Update, _ctx: ContextTypes.DEFAULT_TYPE):
-    old = _get_session(update.effective_chat.id).session_id
-    _sessions[update.effective_chat.id] = Session()
+    chat_id = update.effective_chat.id
+    s = _get_session(chat_id)
+    old = s.session_id
+    if s.busy or _get_chat_lock(chat_id).locked():
+        # In-flight turn still owns this object (see ses:new) — replace
+        # instead of resetting under it.
+        _sessions[chat_id] = Session()
+    else:
+        s.reset()
     _save_sessions()
     msg = "New session started."
     if old:
@@ -1585,7 +2268,9 @@ async def cmd_session(update: Update, _ctx: ContextTypes.DEFAULT_TYPE):
 async def cmd_sessions(update: Update, _ctx: ContextTypes.DEFAULT_TYPE):
     """Browse Claude Code session history with pagination buttons."""
     page_size = 5
-    sessions_list, total = _scan_cc_sessions(limit=page_size, offset=0)
+    sessions_list, total = await asyncio.to_thread(
+        _scan_cc_sessions, limit=page_size, offset=0
+    )
     if not sessions_list:
         await update.message.reply_text("No session history found.")
         return
@@ -1601,17 +2286,19 @@ async def cmd_sessions(update: Update, _ctx: ContextTypes.DEFAULT_TYPE):
 
 @_auth
 async def cmd_compact(update: Update, _ctx: ContextTypes.DEFAULT_TYPE):
-    s = _get_session(update.effective_chat.id)
-    if s.busy:
+    chat_id = update.effective_chat.id
+    s = _get_session(chat_id)
+    lock = _get_chat_lock(chat_id)
+    if s.busy or lock.locked():
         await update.message.reply_text("Cannot compact while a request is in progress.")
         return
     if not s.session_id:
         await update.message.reply_text("No active session to compact.")
         return
 
+    await lock.acquire()
     s.busy = True
-    stop = asyncio.Event()
-    typing = asyncio.create_task(_keep_typing(update.effective_chat, stop))
+    _typing_chats[chat_id] = time.monotonic()
 
     try:
         summary = await run_claude(
@@ -1632,10 +2319,14 @@ async def cmd_compact(update: Update, _ctx: ContextTypes.DEFAULT_TYPE):
         old_count = s.message_count
         new_s = Session(
             session_id=fresh.get("session_id"),
-            created_at=datetime.now().strftime("%Y-%m-%d %H:%M"),
+            created_at=_now_minute_str(),
             message_count=1,
         )
-        _sessions[update.effective_chat.id] = new_s
+        _sessions[chat_id] = new_s
+        # Let other chats run before the save/reply tail — on a large
+        # summary the post-processing here can otherwise monopolize the
+        # loop for several milliseconds.
+        await asyncio.sleep(0)
         _save_sessions()
 
         await update.message.reply_text(
@@ -1644,8 +2335,8 @@ async def cmd_compact(update: Update, _ctx: ContextTypes.DEFAULT_TYPE):
         )
     finally:
         s.busy = False
-        stop.set()
-        typing.cancel()
+        _typing_chats.pop(chat_id, None)
+        lock.release()
 
 
 @_auth
@@ -1662,21 +2353,21 @@ async def cmd_clear(update: Update, _ctx: ContextTypes.DEFAULT_TYPE):
 async def cmd_model(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     if not ctx.args:
         current = _settings.get("model", "default")
-        aliases = "\n".join([f"- {k}: {v}" for k, v in MODEL_ALIASES.items()])
         await update.message.reply_text(
-            f"Current model: {current}\n\nAliases:\n{aliases}"
+            f"Current model: {current}\n\nAliases:\n{_MODEL_ALIASES_HELP}"
         )
         return
 
-    name = ctx.args[0].lower()
-    if name in ("default", "reset"):
+    raw = ctx.args[0]
+    if raw in ("default", "reset") or raw.lower() in ("default", "reset"):
         _settings.pop("model", None)
     else:
-        full_id = MODEL_ALIASES.get(name, ctx.args[0])
+        # Two-probe lookup: exact key first, lower-cased only on miss.
+        full_id = MODEL_ALIASES.get(raw) or _MODEL_ALIASES_CI.get(raw.lower(), raw)
         _settings["model"] = full_id
-    
+
     _save_settings()
-    await update.message.reply_text(f"Model set to: {_settings.get('model', 'default')}")
+    await _reply_coalesced(update.effective_chat, f"Model set to: {_settings.get('model', 'default')}")
 
 
 @_auth
@@ -1696,14 +2387,12 @@ async def cmd_sudo(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     
     _save_settings()
     state = "ENABLED" if _settings.get("skip_permissions") == "1" else "DISABLED"
-    await update.message.reply_text(f"Sudo (skip-permissions) is now {state}")
+    await _reply_coalesced(update.effective_chat, f"Sudo (skip-permissions) is now {state}")
 
 
-@_auth
-async def cmd_settings(update: Update, _ctx: ContextTypes.DEFAULT_TYPE):
-    model = _settings.get("model", "default")
-    sudo = "on" if _settings.get("skip_permissions") == "1" else "off"
-    await update.message.reply_text(
+@functools.lru_cache(maxsize=16)
+def _settings_text(model: str, sudo: str) -> str:
+    return (
         f"Model: {model}\n"
         f"Sudo: {sudo}\n"
         f"Timeout: {COMMAND_TIMEOUT}s\n"
@@ -1711,38 +2400,57 @@ async def cmd_settings(update: Update, _ctx: ContextTypes.DEFAULT_TYPE):
     )
 
 
-# --- Git slash commands ---
-
-
 @_auth
-async def cmd_commit(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    extra = " ".join(ctx.args) if ctx.args else ""
-    await _relay(update, f"/commit {extra}".strip())
+async def cmd_settings(update: Update, _ctx: ContextTypes.DEFAULT_TYPE):
+    model = _settings.get("model", "default")
+    sudo = "on" if _settings.get("skip_permissions") == "1" else "off"
+    await _reply_coalesced(update.effective_chat, _settings_text(model, sudo))
 
 
-@_auth
-async def cmd_diff(update: Update, _ctx: ContextTypes.DEFAULT_TYPE):
-    await _relay(
-        update,
-        "Run `git diff` and show the output. If large, summarize key changes.",
-    )
+# --- Git slash commands ---
 
 
-@_auth
-async def cmd_status(update: Update, _ctx: ContextTypes.DEFAULT_TYPE):
-    await _relay(update, "Run `git status` and show the output concisely.")
+# Slash commands that just relay a canned prompt, as
+# (template, arg mode, default, usage). Mode "join" joins all args,
+# "first" takes the first; a None default makes the argument required
+# and `usage` is the reply when it is missing.
+_SLASH_TEMPLATES = {
+    "commit": ("/commit {arg}", "join", "", None),
+    "diff": (
+        "Run `git diff` and show the output. If large, summarize key changes.",
+        "join", "", None,
+    ),
+    "status": ("Run `git status` and show the output concisely.", "join", "", None),
+    "log": ("Run `git log --oneline -n {arg}` and show the output.", "first", "10", None),
+    "pr": ("Create a pull request. {arg}", "join", "", None),
+    "stash": ("Run `git stash {arg}` and show result.", "first", "list", None),
+    "undo": ("Run `git reset --soft HEAD~1` and show result.", "join", "", None),
+    "find": ("Find files matching pattern `{arg}`.", "join", None, "Usage: /find <pattern>"),
+    "read": ("Read the contents of `{arg}`.", "first", None, "Usage: /read <path>"),
+    "edit": ("{arg}", "join", None, "Usage: /edit <instruction>"),
+    "run": (
+        "Run this shell command and show the full output:\n```\n{arg}\n```",
+        "join", None, "Usage: /run <command>",
+    ),
+}
 
 
-@_auth
-async def cmd_log(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    n = ctx.args[0] if ctx.args else "10"
-    await _relay(update, f"Run `git log --oneline -n {n}` and show the output.")
+def _slash_handler(name: str):
+    """Build the relay handler for one _SLASH_TEMPLATES entry."""
+    template, mode, default, usage = _SLASH_TEMPLATES[name]
 
+    @_auth
+    async def handler(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+        if ctx.args:
+            arg = " ".join(ctx.args) if mode == "join" else ctx.args[0]
+        elif default is None:
+            await update.message.reply_text(usage)
+            return
+        else:
+            arg = default
+        await _relay(update, template.format(arg=arg).strip())
 
-@_auth
-async def cmd_pr(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    extra = " ".join(ctx.args) if ctx.args else ""
-    await _relay(update, f"Create a pull request. {extra}".strip())
+    return handler
 
 
 @_auth
@@ -1754,59 +2462,6 @@ async def cmd_branch(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         await _relay(update, f"Switch to (or create) branch `{branch}` and show result.")
 
 
-@_auth
-async def cmd_stash(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    op = ctx.args[0] if ctx.args else "list"
-    await _relay(update, f"Run `git stash {op}` and show result.")
-
-
-@_auth
-async def cmd_undo(update: Update, _ctx: ContextTypes.DEFAULT_TYPE):
-    await _relay(update, "Run `git reset --soft HEAD~1` and show result.")
-
-
-# --- Files & Misc ---
-
-
-@_auth
-async def cmd_find(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    if not ctx.args:
-        await update.message.reply_text("Usage: /find <pattern>")
-        return
-    pattern = " ".join(ctx.args)
-    await _relay(update, f"Find files matching pattern `{pattern}`.")
-
-
-@_auth
-async def cmd_read(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    if not ctx.args:
-        await update.message.reply_text("Usage: /read <path>")
-        return
-    path = ctx.args[0]
-    await _relay(update, f"Read the contents of `{path}`.")
-
-
-@_auth
-async def cmd_edit(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    if not ctx.args:
-        await update.message.reply_text("Usage: /edit <instruction>")
-        return
-    instr = " ".join(ctx.args)
-    await _relay(update, instr)
-
-
-@_auth
-async def cmd_run(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    if not ctx.args:
-        await update.message.reply_text("Usage: /run <command>")
-        return
-    cmd = " ".join(ctx.args)
-    await _relay(
-        update,
-        f"Run this shell command and show the full output:\n```\n{cmd}\n```",
-    )
-
-
 # --- Self-update / restart ---
 
 
@@ -1815,17 +2470,17 @@ async def cmd_restart(update: Update, _ctx: ContextTypes.DEFAULT_TYPE) -> None:
     """Syntax-check bot.py then restart via systemd."""
     await update.message.reply_text("Checking syntax...")
 
-    proc = await asyncio.create_subprocess_exec(
-        sys.executable, "-m", "py_compile", str(BOT_DIR / "bot.py"),
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-    )
-    _, stderr_out = await proc.communicate()
+    def _check() -> None:
+        path = BOT_DIR / "bot.py"
+        compile(path.read_bytes(), str(path), "exec")
 
-    if proc.returncode != 0:
-        err = stderr_out.decode().strip()
+    try:
+        # In-process parse on a worker thread — same check py_compile
+        # does, without booting a whole interpreter for it.
+        await asyncio.to_thread(_check)
+    except SyntaxError as e:
         await update.message.reply_text(
-            f"Syntax error — restart aborted:\n```\n{err}\n```",
+            f"Syntax error — restart aborted:\n```\n{e.msg} (line {e.lineno})\n```",
             parse_mode="Markdown",
         )
         return
@@ -1837,6 +2492,7 @@ async def cmd_restart(update: Update, _ctx: ContextTypes.DEFAULT_TYPE) -> None:
     # Uses arg-list form (no shell) — safe, no user input involved.
     await asyncio.create_subprocess_exec(
         "systemctl", "--user", "restart", "claude-telegram",
+        close_fds=False,
     )
 
 
@@ -1907,12 +2563,17 @@ async def handle_photo(update: Update, _ctx: ContextTypes.DEFAULT_TYPE):
 
     caption = update.message.caption or ""
 
-    if session.pending_skill:
-        skill = session.pending_skill
-        session.pending_skill = None
-        _record_recent(chat_id, skill)
+    if session.pending_action:
+        kind, name = session.pending_action
+        session.pending_action = None
+        if kind == "git":
+            _record_recent(chat_id, f"git:{name}")
+            base = _git_input_prompt(name, caption)
+        else:
+            _record_recent(chat_id, name)
+            base = f"/{name} {caption}"
         prompt = (
-            f"/{skill} {caption}\n\n"
+            f"{base}\n\n"
             f"[User attached an image: {path} — view it with the Read tool]"
         )
     elif caption:
@@ -1926,33 +2587,67 @@ async def handle_photo(update: Update, _ctx: ContextTypes.DEFAULT_TYPE):
     await _relay(update, prompt)
 
 
+def _git_input_prompt(name: str, text: str) -> str:
+    """Build the relay prompt for a pending git input (branch picks
+    between two prompts, the rest reuse the slash-command templates)."""
+    if name == "branch":
+        return (
+            f"Switch to (or create) branch `{text}` and show result."
+            if text.strip()
+            else "Run `git branch -a` and show the output."
+        )
+    if name in _SLASH_TEMPLATES:
+        return _SLASH_TEMPLATES[name][0].format(arg=text).strip()
+    return text
+
+
+# Inbound text coalescing: Telegram clients split long pastes at ~4096
+# chars, delivering them as back-to-back updates. Buffer briefly and
+# relay one combined prompt instead of one Claude turn per fragment.
+_MSG_WINDOW = 0.8
+_MSG_WINDOW_SPLIT = 2.0  # a near-limit chunk usually means more is coming
+_msg_buffers: dict[int, list[str]] = {}
+_msg_tasks: dict[int, asyncio.Task] = {}
+
+
+async def _relay_coalesced(update: Update, text: str) -> None:
+    chat_id = update.effective_chat.id
+    _msg_buffers.setdefault(chat_id, []).append(text)
+    prior = _msg_tasks.pop(chat_id, None)
+    if prior:
+        prior.cancel()  # still in its wait window — extend it
+
+    async def _flush() -> None:
+        await asyncio.sleep(_MSG_WINDOW_SPLIT if len(text) >= 4000 else _MSG_WINDOW)
+        # Past the sleep there is no await before both pops, so a late
+        # arrival can no longer cancel an in-flight relay.
+        _msg_tasks.pop(chat_id, None)
+        parts = _msg_buffers.pop(chat_id, [])
+        if parts:
+            await _relay(update, "\n".join(parts))
+
+    _msg_tasks[chat_id] = asyncio.create_task(_flush())
+
+
 @_auth
 async def handle_message(update: Update, _ctx: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
     session = _get_session(chat_id)
     text = update.message.text
 
-    if session.pending_skill:
-        skill = session.pending_skill
-        session.pending_skill = None
-
-        # Handle git commands that were pending input
-        if skill.startswith("git:"):
-            action = skill[4:]
-            git_prompts = {
-                "commit": f"/commit {text}".strip(),
-                "branch": f"Switch to (or create) branch `{text}` and show result." if text.strip() else "Run `git branch -a` and show the output.",
-                "stash": f"Run `git stash {text}` and show result.",
-                "pr": f"Create a pull request. {text}".strip(),
-            }
-            prompt = git_prompts.get(action, text)
-            _record_recent(chat_id, skill)
-            await _relay(update, prompt)
+    if session.pending_action:
+        kind, name = session.pending_action
+        session.pending_action = None
+
+        # Git commands that were pending input
+        if kind == "git":
+            _record_recent(chat_id, f"git:{name}")
+            await _relay(update, _git_input_prompt(name, text))
             return
 
         # Regular skill — prefix with slash command
-        _record_recent(chat_id, skill)
-        await _relay(update, f"/{skill} {text}")
+        _record_recent(chat_id, name)
+        await _relay(update, f"/{name} {text}")
         return
 
     # VPS routing: check for prefix like "/fleet ..." or "/hadrian ..."
@@ -1963,7 +2658,7 @@ async def handle_message(update: Update, _ctx: ContextTypes.DEFAULT_TYPE):
             await _relay(update, text, vps_override=_vps_routes[prefix])
             return
 
-    await _relay(update, text)
+    await _relay_coalesced(update, text)
 
 
 # ---------------------------------------------------------------------------
@@ -1971,70 +2666,90 @@ async def handle_message(update: Update, _ctx: ContextTypes.DEFAULT_TYPE):
 # ---------------------------------------------------------------------------
 
 
+_BOT_COMMANDS = (
+    BotCommand("menu", "Open button menu"),
+    BotCommand("new", "Fresh session"),
+    BotCommand("model", "Set/show model"),
+    BotCommand("sudo", "Toggle sudo"),
+    BotCommand("status", "Git status"),
+    BotCommand("diff", "Git diff"),
+    BotCommand("commit", "Commit changes"),
+    BotCommand("run", "Run shell command"),
+    BotCommand("sessions", "Browse session history"),
+    BotCommand("restart", "Syntax-check & restart bot"),
+    BotCommand("vps", "Manage VPS routing"),
+    BotCommand("help", "Show help"),
+)
+
+# (command name, handler) pairs — main() builds CommandHandlers from this.
+_COMMANDS = (
+    ("start", cmd_start),
+    ("help", cmd_help),
+    ("menu", cmd_menu),
+    ("new", cmd_new),
+    ("session", cmd_session),
+    ("sessions", cmd_sessions),
+    ("compact", cmd_compact),
+    ("clear", cmd_clear),
+    ("model", cmd_model),
+    ("sudo", cmd_sudo),
+    ("settings", cmd_settings),
+    ("status", _slash_handler("status")),
+    ("diff", _slash_handler("diff")),
+    ("commit", _slash_handler("commit")),
+    ("log", _slash_handler("log")),
+    ("branch", cmd_branch),
+    ("stash", _slash_handler("stash")),
+    ("undo", _slash_handler("undo")),
+    ("pr", _slash_handler("pr")),
+    ("find", _slash_handler("find")),
+    ("read", _slash_handler("read")),
+    ("edit", _slash_handler("edit")),
+    ("run", _slash_handler("run")),
+    ("restart", cmd_restart),
+    ("vps", cmd_vps),
+)
+
+
 async def _post_init(app: Application) -> None:
-    await app.bot.set_my_commands(
-        [
-            BotCommand("menu", "Open button menu"),
-            BotCommand("new", "Fresh session"),
-            BotCommand("model", "Set/show model"),
-            BotCommand("sudo", "Toggle sudo"),
-            BotCommand("status", "Git status"),
-            BotCommand("diff", "Git diff"),
-            BotCommand("commit", "Commit changes"),
-            BotCommand("run", "Run shell command"),
-            BotCommand("sessions", "Browse session history"),
-            BotCommand("restart", "Syntax-check & restart bot"),
-            BotCommand("vps", "Manage VPS routing"),
-            BotCommand("help", "Show help"),
-        ]
-    )
+    await app.bot.set_my_commands(_BOT_COMMANDS)
+    app.create_task(_typing_heartbeat(app.bot))
+    app.create_task(asyncio.to_thread(_get_skills))  # warm skill discovery
     logger.info("Bot commands registered with Telegram")
 
 
 def main() -> None:
     _acquire_lock()
 
+    # Optional, like orjson: not a required dependency, but when uvloop is
+    # installed its C event loop cuts per-await overhead for the subprocess
+    # pipes, typing heartbeat, and to_thread hops.
+    try:
+        import uvloop
+        uvloop.install()
+        logger.info("Using uvloop event loop")
+    except ImportError:
+        pass
+
     app = (
         Application.builder()
         .token(TELEGRAM_TOKEN)
-        .concurrent_updates(True)
+        # Bounded rather than unbounded concurrency: updates are handled
+        # in parallel so a long Claude turn never blocks getUpdates, but a
+        # flood cannot spawn an arbitrary number of tasks.
+        .concurrent_updates(64)
         .post_init(_post_init)
         .build()
     )
 
-    handlers = [
-        CommandHandler("start", cmd_start),
-        CommandHandler("help", cmd_help),
-        CommandHandler("menu", cmd_menu),
-        CommandHandler("new", cmd_new),
-        CommandHandler("session", cmd_session),
-        CommandHandler("sessions", cmd_sessions),
-        CommandHandler("compact", cmd_compact),
-        CommandHandler("clear", cmd_clear),
-        CommandHandler("model", cmd_model),
-        CommandHandler("sudo", cmd_sudo),
-        CommandHandler("settings", cmd_settings),
-        CommandHandler("status", cmd_status),
-        CommandHandler("diff", cmd_diff),
-        CommandHandler("commit", cmd_commit),
-        CommandHandler("log", cmd_log),
-        CommandHandler("branch", cmd_branch),
-        CommandHandler("stash", cmd_stash),
-        CommandHandler("undo", cmd_undo),
-        CommandHandler("pr", cmd_pr),
-        CommandHandler("find", cmd_find),
-        CommandHandler("read", cmd_read),
-        CommandHandler("edit", cmd_edit),
-        CommandHandler("run", cmd_run),
-        CommandHandler("restart", cmd_restart),
-        CommandHandler("vps", cmd_vps),
+    handlers = [CommandHandler(name, fn) for name, fn in _COMMANDS]
+    handlers += [
         CallbackQueryHandler(handle_callback),
         MessageHandler(filters.PHOTO, handle_photo),
         MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message),
     ]
 
-    for h in handlers:
-        app.add_handler(h)
+    app.add_handlers(handlers)
 
     logger.info("Starting bot (work_dir=%s, claude=%s)", WORK_DIR, CLAUDE_BIN)
     app.run_polling(allowed_updates=Update.ALL_TYPES)